@@ -1,17 +1,48 @@
 import os
+import sys
 import pandas as pd
 
-# Define the path to the CSV files
+from psd_etl import add_derived_attributes, add_population, aggregate_commodities, aggregate_regions, population_dimension
+from psd_ingest import find_source, open_source, read_psd, record_source, source_checksum, source_unchanged
+from psd_kpi import build_kpi_table
+from psd_store import data_version, write_artifacts
+
+# Define the path to the CSV files (read from psd_grains_pulses_csv.zip / Population.zip next to them when not extracted)
 BasePath = os.path.dirname(os.path.abspath(__file__))
 PathData = os.path.join(BasePath, '..', 'data', 'psd_grains_pulses.csv')
 PathPopulationData = os.path.join(BasePath, '..', 'data', 'Population.csv')
 
-# Read the CSV files
-df = pd.read_csv(PathData)
-population_df = pd.read_csv(PathPopulationData)
-
-# Step 1: Subset the dataset to include the observations where the country_codes are 'MO', 'EG', 'LY', 'TS', 'AG', 'MR'
-subset_df = df[df['Country_Code'].isin(['MO', 'EG', 'LY', 'TS', 'AG', 'MR', 'JO'])].copy()
+# Regional aggregates of the grains balances: code → (name, member country codes)
+GRAINS_REGIONS = {
+    'NN':  ('North Africa', ['MA', 'EG', 'LY', 'TN', 'DZ', 'MR', 'JO']),
+    'SNE': ('SNE Countries', ['MR', 'MA', 'DZ', 'LY', 'TN']),
+}
+
+output_path = os.path.join(BasePath, 'psd_north_africa')
+write_csv = os.getenv('PSD_WRITE_CSV', '1') != '0'
+write_db = os.getenv('PSD_WRITE_SQLITE', '0') == '1'
+
+# Step 0: Skip the build if the artifacts were last built by this script from the same sources
+# (checksums of their content, see source_checksum) and options, unless PSD_FORCE=1
+psd_source = find_source(PathData)
+population_source = find_source(PathPopulationData)
+fingerprint = {
+    'build': 'grains',
+    'config': repr(GRAINS_REGIONS),
+    'options': [write_csv, write_db],
+    'psd': source_checksum(*psd_source),
+    'population': source_checksum(*population_source),
+}
+if (os.getenv('PSD_FORCE', '0') != '1' and data_version(output_path) is not None
+        and source_unchanged(output_path, fingerprint)):
+    print("Sources unchanged since the last build, nothing to do (PSD_FORCE=1 to rebuild)")
+    sys.exit(0)
+
+# Step 1: Stream the PS&D file, keeping only the needed columns and the observations where the
+# country_codes are 'MO', 'EG', 'LY', 'TS', 'AG', 'MR'
+subset_df = read_psd(psd_source[0], ['MO', 'EG', 'LY', 'TS', 'AG', 'MR', 'JO'], member=psd_source[1])
+with open_source(*population_source) as f:
+    population_df = pd.read_csv(f)
 
 # Strip any whitespace from the Country_Code column to avoid hidden characters
 subset_df['Country_Code'] = subset_df['Country_Code'].str.strip()
@@ -25,86 +56,36 @@ print("Unique country codes after replacement:", subset_df['Country_Code'].uniqu
 # Step 3: Eliminate the observations for Attribute_ID=184, Attribute_Description=Yield
 subset_df = subset_df[subset_df['Attribute_ID'] != 184]
 
-# Step 4: Eliminate the variables Calendar_Year and Month
-subset_df = subset_df.drop(columns=['Calendar_Year', 'Month'])
-
-# Step 5: Aggregate the variable Value for all Commodity_Code and Commodity_Description
-agg_columns = ['Country_Code', 'Country_Name', 'Market_Year', 'Attribute_ID', 'Attribute_Description', 'Unit_ID', 'Unit_Description']
-aggregated_df = subset_df.groupby(agg_columns)['Value'].sum().reset_index()
-aggregated_df['Commodity_Description'] = 'Cereals'
-aggregated_df['Commodity_Code'] = 400000
-
-# Append the aggregated "Cereals" data to the original subset_df
-subset_df = pd.concat([subset_df, aggregated_df], ignore_index=True)
+# Step 4: The variables Calendar_Year and Month are not read by read_psd
 
-# Step 6: Create country aggregate for "North Africa" with country code "NN"
-country_agg_columns = ['Commodity_Code', 'Commodity_Description', 'Market_Year', 'Attribute_ID', 'Attribute_Description', 'Unit_ID', 'Unit_Description']
-country_aggregated_df = subset_df.groupby(country_agg_columns)['Value'].sum().reset_index()
-country_aggregated_df['Country_Code'] = 'NN'
-country_aggregated_df['Country_Name'] = 'North Africa'
+# Step 5: Aggregate the variable Value of the cereal commodities into "Cereals" (400000, see COMMODITY_AGGREGATES in psd_etl)
+# and append it to the original subset_df
+subset_df = aggregate_commodities(subset_df, codes=[400000])
 
-# Ensure the Country_Code and Country_Name for cereals data in North Africa are correctly set
-country_aggregated_df.loc[country_aggregated_df['Commodity_Code'] == 400000, 'Country_Code'] = 'NN'
-country_aggregated_df.loc[country_aggregated_df['Commodity_Code'] == 400000, 'Country_Name'] = 'North Africa'
-
-# Step 6.1: Create country aggregate for "SNE" with country code "SNE"
-sne_agg_columns = ['Commodity_Code', 'Commodity_Description', 'Market_Year', 'Attribute_ID', 'Attribute_Description', 'Unit_ID', 'Unit_Description']
-sne_aggregated_df = subset_df[subset_df['Country_Code'].isin(['MR', 'MA', 'DZ', 'LY', 'TN'])].groupby(sne_agg_columns)['Value'].sum().reset_index()
-sne_aggregated_df['Country_Code'] = 'SNE'
-sne_aggregated_df['Country_Name'] = 'SNE Countries'
-
-# Ensure the Country_Code and Country_Name for cereals data in SNE are correctly set
-sne_aggregated_df.loc[sne_aggregated_df['Commodity_Code'] == 400000, 'Country_Code'] = 'SNE'
-sne_aggregated_df.loc[sne_aggregated_df['Commodity_Code'] == 400000, 'Country_Name'] = 'SNE Countries'
-
-# Append the country aggregated data to the final aggregated dataframe
-final_aggregated_df = pd.concat([subset_df, country_aggregated_df, sne_aggregated_df], ignore_index=True)
+# Step 6: Create the country aggregates "North Africa" (NN, all the countries of the subset) and "SNE" (SNE)
+final_aggregated_df = aggregate_regions(subset_df, regions=GRAINS_REGIONS)
 
 # Step 7: (Re)Calculate yield including for the country and commodity aggregate
-# Note: Yield calculation is Production / Area Harvested with the unit_id 26 and unit_description (MT/HA)
-pivot_df = final_aggregated_df.pivot(index=['Country_Code', 'Country_Name', 'Commodity_Code', 'Commodity_Description', 'Market_Year'], columns='Attribute_Description', values='Value').reset_index()
-print("Columns in pivot_df:", pivot_df.columns)
-print("Sample data in pivot_df:", pivot_df.head())
-
-if 'Production' in pivot_df.columns and 'Area Harvested' in pivot_df.columns:
-    pivot_df['Yield'] = pivot_df['Production'] / pivot_df['Area Harvested']
-    yield_df = pivot_df.melt(id_vars=['Country_Code', 'Country_Name', 'Commodity_Code', 'Commodity_Description', 'Market_Year'], value_vars=['Yield'], var_name='Attribute_Description', value_name='Value')
-    yield_df['Attribute_ID'] = 184
-    yield_df['Unit_ID'] = 26
-    yield_df['Unit_Description'] = '(MT/HA)'
-    final_aggregated_df = pd.concat([final_aggregated_df, yield_df], ignore_index=True)
+# Note: Yield calculation is Production / Area Harvested with the unit_id 26 and unit_description (MT/HA), see DERIVED_ATTRIBUTES in psd_etl
+final_aggregated_df = add_derived_attributes(final_aggregated_df)
 
-# Step 8: Merge the Population file by Country_Code and Market_year
-merged_df = pd.merge(final_aggregated_df, population_df, how='left', left_on=['Country_Code', 'Market_Year'], right_on=['Country_Code', 'Market_Year'])
-
-# Calculate population aggregate for North Africa
-north_africa_population = population_df[population_df['Country_Code'].isin(['MA', 'EG', 'LY', 'TN', 'DZ'])].groupby('Market_Year')['Population'].sum().reset_index()
-north_africa_population['Country_Code'] = 'NN'
-north_africa_population['Country_Name'] = 'North Africa'
-
-# Merge the North Africa population data back to the main population dataframe
-population_df = pd.concat([population_df, north_africa_population], ignore_index=True)
-
-# Calculate population aggregate for SNE
-sne_population = population_df[population_df['Country_Code'].isin(['MR', 'MA', 'DZ', 'TN'])].groupby('Market_Year')['Population'].sum().reset_index()
-sne_population['Country_Code'] = 'SNE'
-sne_population['Country_Name'] = 'SNE Countries'
-
-# Merge the SNE population data back to the main population dataframe
-population_df = pd.concat([population_df, sne_population], ignore_index=True)
-
-# Step 9: Ensure Population data for cereals in North Africa and SNE is included
-merged_df = pd.merge(final_aggregated_df, population_df, how='left', left_on=['Country_Code', 'Market_Year'], right_on=['Country_Code', 'Market_Year'])
-
-# Drop Country_Name_y and rename Country_Name_x to Country_Name
-merged_df = merged_df.drop(columns=['Country_Name_y'])
-merged_df = merged_df.rename(columns={'Country_Name_x': 'Country_Name'})
+# Step 8: Attach the Population by Country_Code and Market_Year, with the North Africa and SNE
+# totals summed over the same countries as their values
+merged_df = add_population(final_aggregated_df, population_dimension(population_df, regions=GRAINS_REGIONS))
 
 # Step 10: Sort the DataFrame by Commodity_Code, Country_Code, and Market_Year
 merged_df = merged_df.sort_values(by=['Commodity_Code', 'Country_Code', 'Market_Year'])
 
-# Step 11: Create a CSV output file called psd_north_africa.csv
-output_path = os.path.join(BasePath, 'psd_north_africa.csv')
-merged_df.to_csv(output_path, index=False)
+# Step 11: Write the typed Arrow artifact psd_north_africa.arrow (memory-mapped by the dashboard)
+# and, unless PSD_WRITE_CSV=0, the psd_north_africa.csv export; PSD_WRITE_SQLITE=1 also writes the indexed
+# psd_north_africa.sqlite database queried by the dashboard with PSD_BACKEND=sqlite
+for written_path in write_artifacts(merged_df, output_path, write_csv=write_csv, write_db=write_db):
+    print(f"Output file created: {written_path}")
+
+# Step 12: Write the KPI table of every country, commodity and market year (psd_north_africa_kpi.arrow and .csv)
+kpi_path = os.path.join(BasePath, 'psd_north_africa_kpi')
+for written_path in write_artifacts(build_kpi_table(merged_df), kpi_path):
+    print(f"Output file created: {written_path}")
 
-print(f"CSV output file created: {output_path}")
\ No newline at end of file
+# Step 13: Record the checksums of the sources of this build (psd_north_africa.source.json)
+record_source(output_path, fingerprint)
@@ -1,128 +1,96 @@
+import argparse
 import os
+import sys
 import pandas as pd
 
-# Define the path to the CSV files
+from psd_etl import COUNTRY_CODES, build_balances, country_code_replacements
+from psd_forecast import update_forecasts
+from psd_incremental import STATE_FILE, build_balances_incremental, config_fingerprint
+from psd_ingest import find_source, open_source, read_psd, record_source, source_checksum, source_unchanged
+from psd_kpi import build_kpi_table
+from psd_store import data_version, partitions_version, write_artifacts, write_partitions
+
+# Define the path to the CSV files (read from psd_alldata_csv.zip / Population.zip next to them when not extracted)
 BasePath = os.path.dirname(os.path.abspath(__file__))
 PathData = os.path.join(BasePath, '..', 'data', 'psd_alldata.csv')
 PathPopulationData = os.path.join(BasePath, '..', 'data', 'Population.csv')
-
-# Read the CSV files
-df = pd.read_csv(PathData)
-population_df = pd.read_csv(PathPopulationData)
-
-# Step 1: Subset the dataset to include the observations where the country_codes are 'MO', 'EG', 'LY', 'TS', 'AG', 'MR'
-subset_df = df[df['Country_Code'].isin(['MO', 'EG', 'LY', 'TS', 'AG', 'MR', 'JO', 'MU'])].copy()
-
-# Strip any whitespace from the Country_Code column to avoid hidden characters
-subset_df['Country_Code'] = subset_df['Country_Code'].str.strip()
-
-# Step 2: Replace country_code AL with DZ, TS with TN, and MO with MA
-subset_df['Country_Code'] = subset_df['Country_Code'].replace({'AG': 'DZ', 'TS': 'TN', 'MO': 'MA', 'MU': 'OM'})
-
-# Verify replacement
-# print("Unique country codes after replacement:", subset_df['Country_Code'].unique())
-
-# Step 3: Eliminate the observations for Attribute_ID=184, Attribute_Description=Yield
-subset_df = subset_df[subset_df['Attribute_ID'] != 184]
-
-# Step 4: Eliminate the variables Calendar_Year and Month
-subset_df = subset_df.drop(columns=['Calendar_Year', 'Month'])
-
-# Function to create commodity aggregates
-def aggregate_commodities(df, codes, new_code, new_description, divide_by=1):
-    agg_columns = ['Country_Code', 'Country_Name', 'Market_Year', 'Attribute_ID', 'Attribute_Description', 'Unit_ID', 'Unit_Description']
-    agg_df = df[df['Commodity_Code'].isin(codes)].copy()
-    agg_df['Value'] = agg_df['Value'] / divide_by
-    agg_df = agg_df.groupby(agg_columns)['Value'].sum().reset_index()
-    agg_df['Commodity_Code'] = new_code
-    agg_df['Commodity_Description'] = new_description
-    return pd.concat([df, agg_df], ignore_index=True)
-
-# Create all commodity aggregates
-subset_df = aggregate_commodities(subset_df, [430000, 440000, 459100, 452000, 422110, 459200, 410000], 400000, 'Cereals')
-subset_df = aggregate_commodities(subset_df, [430000, 440000, 459100, 452000, 459200], 490000, 'Coarse Grains')
-subset_df = aggregate_commodities(subset_df, [2223000, 2221000, 2226000, 2222000, 2224000], 2200000, 'Oilseeds, Total')
-subset_df = aggregate_commodities(subset_df, [4233000, 4235000, 4243000, 4239100, 4232000, 4236000], 4200000, 'Vegetable Oils, Total')
-subset_df = aggregate_commodities(subset_df, [813300, 814200, 813200, 813600, 813100], 810000, 'Oilmeals, Total')
-subset_df = aggregate_commodities(subset_df, [571120, 579220, 574000, 571220, 575100], 570000, 'Fresh Fruit', divide_by=1000)
-subset_df = aggregate_commodities(subset_df, [577901, 577907, 577400], 570001, 'Nuts, Total', divide_by=1000)
-subset_df = aggregate_commodities(subset_df, [111000, 115000, 113000, 114200], 110000, 'Meat, Total')
-
-# Step 5: Create country aggregate for "North Africa" with country code "NN"
-country_agg_columns = ['Commodity_Code', 'Commodity_Description', 'Market_Year', 'Attribute_ID', 'Attribute_Description', 'Unit_ID', 'Unit_Description']
-north_africa_countries = ['MA', 'EG', 'LY', 'TN', 'DZ']
-north_africa_aggregated_df = subset_df[subset_df['Country_Code'].isin(north_africa_countries)].groupby(country_agg_columns)['Value'].sum().reset_index()
-north_africa_aggregated_df['Country_Code'] = 'NN'
-north_africa_aggregated_df['Country_Name'] = 'North Africa'
-
-# Step 6: Create country aggregate for "SNE" with country code "SNE"
-sne_countries = ['MR', 'MA', 'DZ', 'LY', 'TN']
-sne_aggregated_df = subset_df[subset_df['Country_Code'].isin(sne_countries)].groupby(country_agg_columns)['Value'].sum().reset_index()
-sne_aggregated_df['Country_Code'] = 'SNE'
-sne_aggregated_df['Country_Name'] = 'SNE Countries'
-
-# Append the country aggregated data to the final aggregated dataframe
-final_aggregated_df = pd.concat([subset_df, north_africa_aggregated_df, sne_aggregated_df], ignore_index=True)
-
-# Ensure uniqueness to avoid duplicates
-final_aggregated_df = final_aggregated_df.drop_duplicates(subset=['Country_Code', 'Country_Name', 'Commodity_Code', 'Commodity_Description', 'Market_Year', 'Attribute_ID', 'Attribute_Description'])
-
-# Step 7: (Re)Calculate yield including for the country and commodity aggregate
-# Note: Yield calculation is Production / Area Harvested with the unit_id 26 and unit_description (MT/HA)
-pivot_df = final_aggregated_df.pivot(index=['Country_Code', 'Country_Name', 'Commodity_Code', 'Commodity_Description', 'Market_Year'], columns='Attribute_Description', values='Value').reset_index()
-print("Columns in pivot_df:", pivot_df.columns)
-print("Sample data in pivot_df:", pivot_df.head())
-
-if 'Production' in pivot_df.columns and 'Area Harvested' in pivot_df.columns:
-    pivot_df['Yield'] = pivot_df['Production'] / pivot_df['Area Harvested']
-    yield_df = pivot_df.melt(id_vars=['Country_Code', 'Country_Name', 'Commodity_Code', 'Commodity_Description', 'Market_Year'], value_vars=['Yield'], var_name='Attribute_Description', value_name='Value')
-    yield_df['Attribute_ID'] = 184
-    yield_df['Unit_ID'] = 26
-    yield_df['Unit_Description'] = '(MT/HA)'
-    final_aggregated_df = pd.concat([final_aggregated_df, yield_df], ignore_index=True)
-
-# Step 8: Merge the Population file by Country_Code and Market_year
-merged_df = pd.merge(final_aggregated_df, population_df, how='left', left_on=['Country_Code', 'Market_Year'], right_on=['Country_Code', 'Market_Year'])
-
-# Calculate population aggregate for North Africa
-north_africa_population = population_df[population_df['Country_Code'].isin(north_africa_countries)].groupby('Market_Year')['Population'].sum().reset_index()
-north_africa_population['Country_Code'] = 'NN'
-north_africa_population['Country_Name'] = 'North Africa'
-
-# Merge the North Africa population data back to the main population dataframe
-population_df = pd.concat([population_df, north_africa_population], ignore_index=True)
-
-# Calculate population aggregate for SNE
-sne_population = population_df[population_df['Country_Code'].isin(sne_countries)].groupby('Market_Year')['Population'].sum().reset_index()
-sne_population['Country_Code'] = 'SNE'
-sne_population['Country_Name'] = 'SNE Countries'
-
-# Merge the SNE population data back to the main population dataframe
-population_df = pd.concat([population_df, sne_population], ignore_index=True)
-
-# Step 9: Ensure Population data for cereals in North Africa and SNE is included
-merged_df = pd.merge(final_aggregated_df, population_df, how='left', left_on=['Country_Code', 'Market_Year'], right_on=['Country_Code', 'Market_Year'])
-
-# Drop Country_Name_y and rename Country_Name_x to Country_Name
-merged_df = merged_df.drop(columns=['Country_Name_y'])
-merged_df = merged_df.rename(columns={'Country_Name_x': 'Country_Name'})
-
-# Ensure Population is retained
-merged_df['Population'] = merged_df['Population']
-
-# Reapply the country filter to ensure only the specified countries are included
-final_countries = ['MR', 'MA', 'LY', 'DZ', 'TN', 'EG', 'JO', 'OM', 'NN', 'SNE']
-merged_df = merged_df[merged_df['Country_Code'].isin(final_countries)]
-
-# Aggregate to ensure uniqueness
-agg_columns = ['Country_Code', 'Country_Name', 'Commodity_Code', 'Commodity_Description', 'Market_Year', 'Attribute_Description']
-merged_df = merged_df.groupby(agg_columns, as_index=False).agg({'Value': 'sum', 'Population': 'first', 'Attribute_ID': 'first', 'Unit_ID': 'first', 'Unit_Description': 'first'})
-
-# Step 10: Sort the DataFrame by Commodity_Code, Country_Code, and Market_Year
-merged_df = merged_df.sort_values(by=['Commodity_Code', 'Country_Code', 'Market_Year'])
-
-# Step 11: Create a CSV output file called psd_north_africa.csv
-output_path = os.path.join(BasePath, 'psd_north_africa.csv')
-merged_df.to_csv(output_path, index=False)
-
-print(f"CSV output file created: {output_path}")
+PathState = os.path.join(BasePath, STATE_FILE)
+
+parser = argparse.ArgumentParser(description='Build psd_north_africa from the USDA PS&D bulk file.')
+mode = parser.add_mutually_exclusive_group()
+mode.add_argument('--incremental', action='store_true',
+                  help='only recompute the partitions that changed since the previous --incremental run')
+mode.add_argument('--global', dest='global_build', action='store_true',
+                  help='build psd_global with every PS&D country, partitioned by commodity')
+parser.add_argument('--force', action='store_true', default=os.getenv('PSD_FORCE', '0') == '1',
+                    help='rebuild even if the sources did not change since the last build')
+args = parser.parse_args()
+
+output_path = os.path.join(BasePath, 'psd_global' if args.global_build else 'psd_north_africa')
+write_csv = os.getenv('PSD_WRITE_CSV', '1') != '0'
+write_db = os.getenv('PSD_WRITE_SQLITE', '0') == '1'
+write_forecast = os.getenv('PSD_FORECAST', '0') == '1'
+
+# Step 0: Skip the build if the artifacts were last built from the same sources (checksums of their
+# content, see source_checksum), with the same ETL definitions and options
+psd_source = find_source(PathData)
+population_source = find_source(PathPopulationData)
+fingerprint = {
+    'build': 'global' if args.global_build else 'north_africa',
+    'config': config_fingerprint(),
+    'options': [write_csv, write_db, write_forecast],
+    'psd': source_checksum(*psd_source),
+    'population': source_checksum(*population_source),
+}
+built = partitions_version(output_path) if args.global_build else data_version(output_path)
+if not args.force and built is not None and source_unchanged(output_path, fingerprint):
+    print("Sources unchanged since the last build, nothing to do (--force to rebuild)")
+    sys.exit(0)
+
+# Step 1: Stream the PS&D file, keeping only the needed columns and the observations where the
+# country_codes are 'MO', 'EG', 'LY', 'TS', 'AG', 'MR', 'JO', 'MU' (all of them for --global)
+subset_df = read_psd(psd_source[0], None if args.global_build else COUNTRY_CODES, member=psd_source[1])
+with open_source(*population_source) as f:
+    population_df = pd.read_csv(f)
+
+# Steps 2-10: Clean the country codes, create the commodity and regional aggregates, (re)calculate
+# the yields, merge the population and sort (see build_balances in psd_etl)
+if args.global_build:
+    # Map the PS&D country codes to the population codes by country name (unique_countries*.csv)
+    replacements = country_code_replacements(
+        pd.read_csv(os.path.join(BasePath, 'unique_countries.csv'), keep_default_na=False),
+        pd.read_csv(os.path.join(BasePath, 'unique_countries_pop.csv'), keep_default_na=False))
+    merged_df = build_balances(subset_df, population_df, replacements=replacements, countries=None)
+elif args.incremental:
+    merged_df, n_changed = build_balances_incremental(subset_df, population_df, PathState)
+    if n_changed is None:
+        print("No usable previous run, performed a full build")
+    else:
+        print(f"Recomputed {n_changed} changed (country, commodity, market year) partitions")
+else:
+    merged_df = build_balances(subset_df, population_df)
+
+# Step 11: Write the typed Arrow artifact psd_north_africa.arrow (memory-mapped by the dashboard)
+# and, unless PSD_WRITE_CSV=0, the psd_north_africa.csv export; PSD_WRITE_SQLITE=1 also writes the indexed
+# psd_north_africa.sqlite database queried by the dashboard with PSD_BACKEND=sqlite.
+# The global build writes psd_global.partitions, one artifact per commodity loaded on demand by the
+# dashboard with PSD_BACKEND=partitioned
+if args.global_build:
+    print(f"Output partitions created: {write_partitions(merged_df, output_path)}")
+else:
+    for written_path in write_artifacts(merged_df, output_path, write_csv=write_csv, write_db=write_db):
+        print(f"Output file created: {written_path}")
+
+# Step 12: Write the KPI table of every country, commodity and market year (psd_north_africa_kpi.arrow and .csv)
+kpi_path = output_path + '_kpi'
+for written_path in write_artifacts(build_kpi_table(merged_df), kpi_path):
+    print(f"Output file created: {written_path}")
+
+# Step 13: With PSD_FORECAST=1, forecast the Production, Yield and Imports series (psd_north_africa_forecast),
+# refitting only the series that changed since the previous forecast (see psd_forecast)
+if write_forecast:
+    for written_path in update_forecasts(merged_df, output_path):
+        print(f"Output file created: {written_path}")
+
+# Step 14: Record the checksums of the sources of this build (psd_north_africa.source.json)
+record_source(output_path, fingerprint)
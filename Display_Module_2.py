@@ -1,7 +1,7 @@
 import pandas as pd
 import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output, State
+from dash import dash_table, dcc, html
+from dash.dependencies import ClientsideFunction, Input, Output, State
 import os
 import sys
 import numpy as np
@@ -14,14 +14,30 @@ sys.path.insert(0, home_path)
 
 # Now import Navbar from navbar
 from navbar import Navbar
-
-# Set up file paths and load data
+from psd_cache import init_cache, memoize
+from psd_export import available_formats, read_progress, register_export_endpoint, start_export
+from psd_kpi import yield_cagr_column, yield_cv_column
+from psd_metrics import instrument, register_metrics_endpoint
+from psd_snapshot import SnapshotReloader
+from psd_table import PAGE_SIZE, page, table_columns
+from psd_trend import TrendEngine
+
+# Set up file paths and load the dataset: psd_north_africa (memory-mapped .arrow, or .csv, or queried in .sqlite
+# with PSD_BACKEND=sqlite), the KPIs precomputed by the ETL in psd_north_africa_kpi, the yield statistics and
+# the slice index (see Snapshot).
+# The snapshot is rebuilt in the background and swapped in when the ETL publishes new artifacts.
+# PSD_DATASET=psd_global with PSD_BACKEND=partitioned serves the global build (Data_4_module_2_all.py --global)
 BasePath = os.path.dirname(os.path.abspath(__file__))
-PathData = os.path.join(BasePath, 'psd_north_africa.csv')
-data = pd.read_csv(PathData)
+PathData = os.path.join(BasePath, os.getenv('PSD_DATASET', 'psd_north_africa'))
+PathKpi = PathData + '_kpi'
+reloader = SnapshotReloader(PathData, PathKpi)
+data_index = reloader.current.data_index
+
+# Memoized, batched trend line fits of the time-series chart
+trend_engine = TrendEngine()
 
 # Prepare options for the country dropdown
-country_options = [{'label': country, 'value': country} for country in data['Country_Name'].unique()]
+country_options = [{'label': country, 'value': country} for country in data_index.unique('Country_Name')]
 
 # Create a mapping of commodity groups to their respective commodities
 commodity_groups = {
@@ -74,6 +90,15 @@ commodity_groups = {
 # Prepare options for the commodity group dropdown
 commodity_group_options = [{'label': group, 'value': group} for group in commodity_groups.keys()]
 
+# Commodity selected by default in each group
+commodity_group_defaults = {
+    'Cereals': 'Wheat',
+    'Coarse Grains': 'Barley',
+    'Oilseeds': 'Oilseed, Soybean',
+    'Vegetable Oils': 'Oil, Olive',
+    'Oilmeals': 'Meal, Soybean'
+}
+
 # Prepare options for the commodity dropdown including aggregate options
 commodity_options = [{'label': desc, 'value': desc} for group in commodity_groups.values() for desc in group.values()]
 commodity_options.extend([
@@ -87,6 +112,40 @@ commodity_options.extend([
 # Initialize the Dash app
 app = dash.Dash(__name__, assets_folder='assets')
 
+# WSGI entry point of the production server: gunicorn -c gunicorn.conf.py Display_Module_2:server
+server = app.server
+
+@server.route('/health')
+def health():
+    return 'OK'
+
+# Serve per-callback latency, rows scanned and response size histograms at /metrics (Prometheus format)
+register_metrics_endpoint(app.server)
+
+# Serve the files of the bulk exports at /exports/<job id>
+register_export_endpoint(app.server)
+
+# Cache of the figure and KPI callbacks, shared by the workers and keyed on the data version
+cache = init_cache(app.server)
+
+def data_versions():
+    """Key of every memoized callback: the versions of all the artifacts of the current snapshot
+    (balances, KPIs and forecasts), so that a reload of any of them invalidates every entry."""
+    return reloader.current.versions
+
+def selection_snapshot(versions):
+    """Return the current snapshot if it has the given artifact versions (those of a selection), else stop the callback.
+
+    A selection is computed on one snapshot; a reload in between (or another worker, which reloads on its own
+    schedule) must not answer it from different data, so its outputs are left unchanged instead."""
+    snapshot = reloader.current
+    if versions is None or tuple(versions) != snapshot.versions:
+        raise dash.exceptions.PreventUpdate
+    return snapshot
+
+# Watch for new artifacts in every worker and send the data version with each response (and at /data-version)
+reloader.register(app.server)
+
 external_stylesheets = [
     'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.4/css/all.min.css',
     '/assets/style.css'  # Use relative path
@@ -133,13 +192,49 @@ app.layout = html.Div([
         ], style={'display': 'inline-block', 'width': '15%'})
     ], style={'display': 'flex', 'justifyContent': 'space-between', 'padding': '0 10px'}),
     
+    # Availability map of the dropdown cascades (see load_availability)
+    dcc.Store(id='availability-store'),
+
+    # Key of the selected slice (see select_slice)
+    dcc.Store(id='selection-store'),
+
     dcc.Graph(id='balance-graph'),
 
     html.Button("Hide/Show Table", id='toggle-table-button', n_clicks=0, style={'backgroundColor': 'lightblue', 'height': '30px', 'width': '150px'}),
     html.Button("Export CSV", id='export-csv-button', n_clicks=0, style={'backgroundColor': 'darkblue', 'color': 'white', 'height': '30px', 'width': '150px'}),
-    html.Div(id='table-container', style={'display': 'none'}),
+    html.Button("Export KPIs", id='export-kpi-button', n_clicks=0, style={'backgroundColor': 'darkblue', 'color': 'white', 'height': '30px', 'width': '150px'}),
+    # Paged, sorted and filtered on the server; only the visible page is sent to the browser
+    html.Div(dash_table.DataTable(
+        id='data-table',
+        columns=table_columns(data_index.empty()),
+        page_current=0,
+        page_size=PAGE_SIZE,
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
+    ), id='table-container', style={'display': 'none'}),
 
     dcc.Download(id="download-dataframe-csv"),
+    dcc.Download(id="download-kpi-csv"),
+
+    # Bulk export of multi-commodity, multi-country, multi-year selections, written in the background
+    html.Div([
+        html.Label("Bulk export:"),
+        dcc.Dropdown(id='export-commodities', options=sorted(data_index.unique('Commodity_Description')), multi=True,
+                     placeholder='All commodities', style={'width': '30%'}),
+        dcc.Dropdown(id='export-countries', options=sorted(data_index.unique('Country_Name')), multi=True,
+                     placeholder='All countries', style={'width': '30%'}),
+        dcc.Input(id='export-first-year', type='number', placeholder='From year', min=1960, max=2100, step=1, style={'width': '90px'}),
+        dcc.Input(id='export-last-year', type='number', placeholder='To year', min=1960, max=2100, step=1, style={'width': '90px'}),
+        dcc.RadioItems(id='export-format', options=available_formats(), value='csv.gz', inline=True),
+        html.Button("Start Export", id='bulk-export-button', n_clicks=0, style={'backgroundColor': 'darkblue', 'color': 'white', 'height': '30px', 'width': '150px'}),
+    ], style={'display': 'flex', 'alignItems': 'center', 'gap': '10px', 'padding': '10px 0'}),
+    html.Div(id='export-status'),
+    dcc.Store(id='export-job'),
+    dcc.Interval(id='export-progress-interval', interval=1000, disabled=True),
 
     # Add horizontal line and 20px vertical space
     html.Hr(),  # Horizontal line
@@ -150,6 +245,18 @@ app.layout = html.Div([
     # Add KPI container
     html.Div(id='kpi-container', style={'display': 'flex', 'flexWrap': 'wrap'}),
 
+    # Yield variability and growth over a user-selected window
+    html.Div([
+        html.Label("Yield statistics from "),
+        dcc.Input(id='yield-window-start', type='number', value=1980, min=1960, max=2100, step=1, debounce=True, style={'width': '80px'}),
+        html.Label(" to "),
+        dcc.Input(id='yield-window-end', type='number', value=2024, min=1960, max=2100, step=1, debounce=True, style={'width': '80px'}),
+        html.Label(", averaging the first and last "),
+        dcc.Input(id='yield-window-length', type='number', value=5, min=1, max=20, step=1, debounce=True, style={'width': '60px'}),
+        html.Label(" years for the growth rate"),
+    ], style={'padding': '10px'}),
+    html.Div(id='yield-stats-container', style={'display': 'flex', 'flexWrap': 'wrap'}),
+
     # Add horizontal line and 20px vertical space
     html.Hr(),  # Horizontal line
     html.Div(style={'height': '20px'}),  # 20px vertical space
@@ -218,75 +325,76 @@ app.layout = html.Div([
             value=0,  # Default value
             labelStyle={'display': 'inline-block', 'margin-right': '10px'}
         ),
+        # Forecasts precomputed by psd_forecast, with their prediction intervals
+        dcc.Checklist(
+            id='forecast-toggle',
+            options=[{'label': 'Show Forecasts', 'value': 'forecast'}],
+            value=[],
+            labelStyle={'display': 'inline-block', 'margin-right': '10px'}
+        ),
     ], style={'textAlign': 'center', 'padding': '20px 0'})  # Centered and padded
 ])
 
 
-# Update the commodity dropdown based on selected commodity group
+# Ship the availability map of the dropdown cascades once per data version: the commodities of each group
+# and the runs of consecutive market years of each (commodity, country)
 @app.callback(
-    [Output('commodity-dropdown', 'options'),
-     Output('commodity-dropdown', 'value')],
-    Input('commodity-group-dropdown', 'value')
+    Output('availability-store', 'data'),
+    Input('availability-store', 'id')
 )
-def set_commodity_options(selected_group):
-    if selected_group is None:
-        return commodity_options, 'Wheat'
-    
-    options = [{'label': desc, 'value': desc} for code, desc in commodity_groups[selected_group].items()]
-    
-    default_values = {
-        'Cereals': 'Wheat',
-        'Coarse Grains': 'Barley',
-        'Oilseeds': 'Oilseed, Soybean',
-        'Vegetable Oils': 'Oil, Olive',
-        'Oilmeals': 'Meal, Soybean'
+@instrument
+@memoize(cache, data_versions)
+def load_availability(_):
+    snapshot = reloader.current
+    years = {}
+    for (commodity, country), runs in snapshot.data_index.year_runs().items():
+        years.setdefault(commodity, {})[country] = runs
+    return {
+        'version': snapshot.version,
+        # Without a group: the grouped commodities, then every other commodity of the dataset
+        'all': list(dict.fromkeys([option['value'] for option in commodity_options] +
+                                  sorted(snapshot.data_index.unique('Commodity_Description')))),
+        'groups': {group: list(commodities.values()) for group, commodities in commodity_groups.items()},
+        'defaults': commodity_group_defaults,
+        'years': years,
     }
-    
-    default_value = default_values.get(selected_group, options[0]['value'] if options else 'Wheat')
-    
-    return options, default_value
 
+# Update the commodity dropdown based on selected commodity group (in the browser, see assets/psd_cascades.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='psd', function_name='commodityOptions'),
+    [Output('commodity-dropdown', 'options'),
+     Output('commodity-dropdown', 'value')],
+    [Input('commodity-group-dropdown', 'value'),
+     Input('availability-store', 'data')]
+)
 
 # Update the year dropdown based on selected commodity and country
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='psd', function_name='yearOptions'),
     Output('year-dropdown', 'options'),
     [Input('commodity-dropdown', 'value'),
-     Input('country-dropdown', 'value')]
+     Input('country-dropdown', 'value'),
+     Input('availability-store', 'data')]
 )
-def set_year_options(selected_commodity, selected_country):
-    filtered_data = data[(data['Commodity_Description'] == selected_commodity) & (data['Country_Name'] == selected_country)]
-    years = filtered_data['Market_Year'].unique()
-    return [{'label': year, 'value': year} for year in years]
 
 # Update the year dropdown value based on available options (default to the latest year)
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='psd', function_name='yearValue'),
     Output('year-dropdown', 'value'),
     [Input('year-dropdown', 'options')]
 )
-def set_year_value(available_options):
-    return max(option['value'] for option in available_options) if available_options else None
 
-# Define callback to update graph based on selected commodity, country, and year
-@app.callback(
-    [Output('balance-graph', 'figure'),
-     Output('kpi-container', 'children')],
-    [Input('commodity-dropdown', 'value'),
-     Input('country-dropdown', 'value'),
-     Input('year-dropdown', 'value')]
-)
-def update_graph(selected_commodity, selected_country, selected_year):
-    # Filter data based on selections
-    filtered_data = data[(data['Commodity_Description'] == selected_commodity) & 
-                         (data['Country_Name'] == selected_country) &
-                         (data['Market_Year'] == selected_year)]
-    
-    if filtered_data.empty:
-        return {
-            'data': [],
-            'layout': {
-                'title': 'No data available for the selected combination.'
-            }
-        }, []
+# Rows of a selection and its normalized balance, computed once per selection and data version and
+# shared by the graph, KPI, table and export callbacks; callers must not modify the frames
+@memoize(cache, data_versions)
+def balance_slice(versions, selected_commodity, selected_country, selected_year):
+    snapshot = selection_snapshot(versions)
+    # Filter data based on selections; a cleared year selects no rows (a slice without a year is the full history)
+    if selected_year is None:
+        rows = snapshot.data_index.empty()
+    else:
+        rows = snapshot.data_index.slice(selected_commodity, selected_country, selected_year)
+    filtered_data = rows.copy()
 
     # Replace 'Feed Dom. Consumption' with 'Feed'
     filtered_data.loc[filtered_data['Attribute_Description'] == 'Feed Dom. Consumption', 'Attribute_Description'] = 'Feed'
@@ -305,6 +413,57 @@ def update_graph(selected_commodity, selected_country, selected_year):
     filtered_data = filtered_data[(filtered_data['Attribute_Description'] != 'Area Harvested') & 
                                   (filtered_data['Attribute_Description'] != 'Yield')]
 
+    return rows, filtered_data
+
+# Compute the slice of the selection once; the store holds only its key.
+# The table goes back to its first page, which exists for any selection
+@app.callback(
+    [Output('selection-store', 'data'),
+     Output('data-table', 'page_current')],
+    [Input('commodity-dropdown', 'value'),
+     Input('country-dropdown', 'value'),
+     Input('year-dropdown', 'value')]
+)
+@instrument
+def select_slice(selected_commodity, selected_country, selected_year):
+    versions = data_versions()
+    balance_slice(versions, selected_commodity, selected_country, selected_year)
+    return {'version': versions, 'commodity': selected_commodity,
+            'country': selected_country, 'year': selected_year}, 0
+
+# Go back to the first page of the table when its filter changes
+@app.callback(
+    Output('data-table', 'page_current', allow_duplicate=True),
+    [Input('data-table', 'filter_query')],
+    prevent_initial_call=True
+)
+@instrument
+def reset_table_page(filter_query):
+    return 0
+
+# Define callback to update graph based on selected commodity, country, and year
+@app.callback(
+    [Output('balance-graph', 'figure'),
+     Output('kpi-container', 'children')],
+    [Input('selection-store', 'data')]
+)
+@instrument
+@memoize(cache, data_versions)
+def update_graph(selection):
+    if selection is None:
+        raise dash.exceptions.PreventUpdate
+    snapshot = selection_snapshot(selection['version'])
+    selected_commodity, selected_country, selected_year = selection['commodity'], selection['country'], selection['year']
+    rows, filtered_data = balance_slice(snapshot.versions, selected_commodity, selected_country, selected_year)
+    
+    if rows.empty:
+        return {
+            'data': [],
+            'layout': {
+                'title': 'No data available for the selected combination.'
+            }
+        }, []
+
     # Pivot the data to transpose the matrix so that Attribute_Descriptions are columns
     pivoted_data = filtered_data.pivot_table(
         index=['Market_Year'],
@@ -420,81 +579,27 @@ def update_graph(selected_commodity, selected_country, selected_year):
                 'marker': {'color': colors.get(attr, 'gray')},
             })
 
-    # Calculate KPIs
-    production = filtered_data[filtered_data['Attribute_Description'] == 'Production']['Value'].sum()
-    imports = filtered_data[filtered_data['Attribute_Description'] == 'Imports']['Value'].sum()
-    beginning_stocks = filtered_data[filtered_data['Attribute_Description'] == 'Beginning Stocks']['Value'].sum()
-    ending_stocks = filtered_data[filtered_data['Attribute_Description'] == 'Ending Stocks']['Value'].sum()
-    total_supply = production + imports + beginning_stocks - ending_stocks
-
-    self_sufficiency_ratio = production / total_supply if total_supply != 0 else 0
-    import_dependency_ratio = imports / total_supply if total_supply != 0 else 0
-    stocks_to_use_ratio = beginning_stocks / total_supply if total_supply != 0 else 0
-    
-    # Calculate Coefficient of Variation (CV) on first differences of yield
-    def calculate_cv_first_diff(data, start_year, end_year):
-        period_data = data[(data['Market_Year'] >= start_year) & (data['Market_Year'] <= end_year)]
-        if not period_data.empty:
-            first_diff = period_data['Value'].diff().dropna()
-            return (first_diff.std() / first_diff.mean() / 100) if first_diff.mean() != 0 else None
-        return None
-
-    # Calculate CAGR for yield growth rates
-    def calculate_cagr(start_value, end_value, periods):
-        if start_value > 0 and end_value > 0:
-            return (end_value / start_value) ** (1 / periods) - 1
-        return 0
-
-    yield_data = data[(data['Commodity_Description'] == selected_commodity) &
-                      (data['Country_Name'] == selected_country) &
-                      (data['Attribute_Description'] == 'Yield')]
-
-    yield_cv_1 = calculate_cv_first_diff(yield_data, 1960, 1990)
-    yield_cv_2 = calculate_cv_first_diff(yield_data, 1980, 2010)
-    yield_cv_3 = calculate_cv_first_diff(yield_data, 2000, 2024)
-
-    early_yield = yield_data[(yield_data['Market_Year'] >= 1980) & (yield_data['Market_Year'] <= 1984)]['Value'].mean()
-    late_yield = yield_data[(yield_data['Market_Year'] >= 2020) & (yield_data['Market_Year'] <= 2024)]['Value'].mean()
-    mid_yield = yield_data[(yield_data['Market_Year'] >= 2000) & (yield_data['Market_Year'] <= 2004)]['Value'].mean()
-
-    cagr_early_to_late = calculate_cagr(early_yield, late_yield, 40)
-    cagr_mid_to_late = calculate_cagr(mid_yield, late_yield, 20)
-
-    # Filter data based on selections
-    filtered_data = data[(data['Commodity_Description'] == selected_commodity) & 
-                         (data['Country_Name'] == selected_country) &
-                         (data['Market_Year'] == selected_year)]
-
-    # Calculate Yield Ratio to North Africa for the selected year
-    north_africa_yield_data = data[(data['Commodity_Description'] == selected_commodity) &
-                                   (data['Country_Name'] == 'North Africa') &
-                                   (data['Market_Year'] == selected_year) &
-                                   (data['Attribute_Description'] == 'Yield')]
-
-    north_africa_yield = north_africa_yield_data['Value'].mean()
-
-    current_year_yield = filtered_data[(filtered_data['Attribute_Description'] == 'Yield')]['Value'].mean()
-
-    yield_ratio = (current_year_yield / north_africa_yield * 100) if north_africa_yield != 0 else None
-
-    # Calculate Per Capita KPIs
-    population = filtered_data['Population'].values[0] if not filtered_data.empty else 0
-
-    per_capita_production = (production / population) * 1000 if population != 0 else 0
-    per_capita_imports = (imports / population) * 1000 if population != 0 else 0
-    per_capita_supply = (total_supply / population) * 1000 if population != 0 else 0
-
-    # Replace 'FSI Consumption' with 'Food, Seed, Ind. Use'
-    filtered_data.loc[filtered_data['Attribute_Description'] == 'FSI Consumption', 'Attribute_Description'] = 'Food, Seed, Ind. Use'
-
-    # Calculate Per Capita Food, Seed, Ind. Use
-    food_seed_ind_use = filtered_data[filtered_data['Attribute_Description'] == 'Food, Seed, Ind. Use']['Value'].sum()
-
-    # Calculate population value
-    population = filtered_data['Population'].values[0] if not filtered_data.empty else 0
-
-    # Calculate Per Capita Food, Seed, Ind. Use
-    per_capita_food_seed_ind_use = (food_seed_ind_use / population) * 1000 if population != 0 else 0
+    # Look up the precomputed KPIs of the selection (see build_kpi_table in psd_kpi)
+    kpi_rows = snapshot.kpi_index.slice(selected_commodity, selected_country, selected_year)
+    if kpi_rows.empty:
+        return fig, []
+    kpi = kpi_rows.iloc[0]
+
+    def kpi_value(column):
+        return None if pd.isna(kpi[column]) else kpi[column]
+
+    self_sufficiency_ratio = kpi['Self_Sufficiency_Ratio']
+    import_dependency_ratio = kpi['Import_Dependency_Ratio']
+    yield_cv_1 = kpi_value(yield_cv_column(1960, 1990))
+    yield_cv_2 = kpi_value(yield_cv_column(1980, 2010))
+    yield_cv_3 = kpi_value(yield_cv_column(2000, 2024))
+    cagr_early_to_late = kpi[yield_cagr_column((1980, 1984), (2020, 2024))]
+    cagr_mid_to_late = kpi[yield_cagr_column((2000, 2004), (2020, 2024))]
+    yield_ratio = kpi_value('Yield_Ratio_Reference')
+    per_capita_production = kpi['Per_Capita_Production']
+    per_capita_imports = kpi['Per_Capita_Imports']
+    per_capita_supply = kpi['Per_Capita_Total_Supply']
+    per_capita_food_seed_ind_use = kpi['Per_Capita_FSI_Consumption']
 
     kpi_tiles = [
         html.Div([
@@ -549,6 +654,36 @@ def update_graph(selected_commodity, selected_country, selected_year):
 
     return fig, kpi_tiles
 
+# Yield variability and growth for the selected window
+@app.callback(
+    Output('yield-stats-container', 'children'),
+    [Input('commodity-dropdown', 'value'),
+     Input('country-dropdown', 'value'),
+     Input('yield-window-start', 'value'),
+     Input('yield-window-end', 'value'),
+     Input('yield-window-length', 'value')]
+)
+@instrument
+def update_yield_stats(selected_commodity, selected_country, start_year, end_year, length):
+    snapshot = reloader.current
+    if start_year is None or end_year is None or length is None or start_year >= end_year:
+        return html.Div('Select a window whose start year is before its end year.')
+
+    start_year, end_year, length = int(start_year), int(end_year), int(length)
+    yield_stats = snapshot.yield_stats(selected_commodity)
+    yield_cv, yield_cagr = yield_stats.lookup(selected_commodity, selected_country, start_year, end_year, length)
+
+    return [
+        html.Div([
+            html.H1(f"Yield Variability (Coefficient of Variation, first difference) {start_year}-{end_year} ({selected_country}, {selected_commodity})", style={'textAlign': 'center'}),
+            html.P(f"{yield_cv:.1%}" if yield_cv is not None else "N/A", style={'fontSize': '50px', 'textAlign': 'center', 'fontWeight': 'bold', 'color':'purple'})
+        ], style={'padding': '20px', 'margin': '10px', 'border': '1px solid #ccc', 'borderRadius': '5px', 'width': '28%', 'backgroundColor': '#e6f7ff'}),
+        html.Div([
+            html.H1(f"CAGR Yield Growth ({start_year}/{str(start_year + length - 1)[-2:]} - {end_year - length + 1}/{str(end_year)[-2:]}) ({selected_country}, {selected_commodity})", style={'textAlign': 'center'}),
+            html.P(f"{yield_cagr:.2%}" if yield_cagr is not None else "N/A", style={'fontSize': '50px', 'textAlign': 'center', 'fontWeight': 'bold', 'color':'blue'})
+        ], style={'padding': '20px', 'margin': '10px', 'border': '1px solid #ccc', 'borderRadius': '5px', 'width': '28%', 'backgroundColor': '#e6f7ff'}),
+    ]
+
 # Update line chart with trend lines
 @app.callback(
     Output('line-chart', 'figure'),
@@ -556,9 +691,13 @@ def update_graph(selected_commodity, selected_country, selected_year):
      Input('country-dropdown', 'value'),
      Input('attribute-checklist-primary', 'value'),
      Input('attribute-checklist-secondary', 'value'),
-     Input('trendline-order', 'value')]
+     Input('trendline-order', 'value'),
+     Input('forecast-toggle', 'value')]
 )
-def update_line_chart(selected_commodity, selected_country, primary_attributes, secondary_attributes, trendline_order):
+@instrument
+@memoize(cache, data_versions)
+def update_line_chart(selected_commodity, selected_country, primary_attributes, secondary_attributes, trendline_order, forecast_toggle):
+    snapshot = reloader.current
     # Define unique colors for each attribute
     colors = {
         'Production': 'blue',
@@ -575,8 +714,7 @@ def update_line_chart(selected_commodity, selected_country, primary_attributes,
     }
 
     # Filter data based on selections
-    filtered_data = data[(data['Commodity_Description'] == selected_commodity) & 
-                         (data['Country_Name'] == selected_country)]
+    filtered_data = snapshot.data_index.slice(selected_commodity, selected_country)
     
     # Drop 'Food, Seed, Ind. Use'
     filtered_data = filtered_data[filtered_data['Attribute_Description'] != 'Food, Seed, Ind. Use']
@@ -643,6 +781,17 @@ def update_line_chart(selected_commodity, selected_country, primary_attributes,
         }
     }
 
+    # Fit the trend lines of all selected series at once (coefficients are memoized per series and order)
+    trend_coefficients = {}
+    if trendline_order > 0:
+        trend_attributes = [attr for attr in dict.fromkeys(primary_attributes + secondary_attributes) if attr in pivoted_data.columns]
+        trend_coefficients = trend_engine.fit(
+            (snapshot.version, selected_commodity, selected_country),
+            pivoted_data['Market_Year'].to_numpy(),
+            {attr: pivoted_data[attr].to_numpy() for attr in trend_attributes},
+            trendline_order
+        )
+
     # Add lines for each primary attribute
     for primary_attribute in primary_attributes:
         if primary_attribute in pivoted_data.columns:
@@ -655,8 +804,8 @@ def update_line_chart(selected_commodity, selected_country, primary_attributes,
                 'yaxis': 'y1'
             })
             # Add trend line for primary attribute if trendline_order is not None
-            if trendline_order > 0:
-                z = np.polyfit(pivoted_data['Market_Year'], pivoted_data[primary_attribute], trendline_order)
+            if primary_attribute in trend_coefficients:
+                z = trend_coefficients[primary_attribute]
                 p = np.poly1d(z)
                 trendline = p(pivoted_data['Market_Year'])
                 equation = f'{z[0]:.2f}x'
@@ -670,8 +819,7 @@ def update_line_chart(selected_commodity, selected_country, primary_attributes,
                     'line': {'dash': 'dash', 'color': colors.get(primary_attribute, 'gray')}
                 })
         elif primary_attribute == 'Population':
-            country_population = data[(data['Country_Name'] == selected_country) & 
-                                      (data['Attribute_Description'] == 'Total Population')]
+            country_population = snapshot.data_index.query(country=selected_country, attribute='Total Population')
             fig['data'].append({
                 'x': country_population['Market_Year'],
                 'y': country_population['Value'],
@@ -693,8 +841,8 @@ def update_line_chart(selected_commodity, selected_country, primary_attributes,
                 'yaxis': 'y2'
             })
             # Add trend line for secondary attribute if trendline_order is not None
-            if trendline_order > 0:
-                z = np.polyfit(pivoted_data['Market_Year'], pivoted_data[secondary_attribute], trendline_order)
+            if secondary_attribute in trend_coefficients:
+                z = trend_coefficients[secondary_attribute]
                 p = np.poly1d(z)
                 trendline = p(pivoted_data['Market_Year'])
                 equation = f'{z[0]:.2f}x'
@@ -708,8 +856,7 @@ def update_line_chart(selected_commodity, selected_country, primary_attributes,
                     'line': {'dash': 'dash', 'color': colors.get(secondary_attribute, 'gray')}
                 })
         elif secondary_attribute == 'Population':
-            country_population = data[(data['Country_Name'] == selected_country) & 
-                                      (data['Attribute_Description'] == 'Total Population')]
+            country_population = snapshot.data_index.query(country=selected_country, attribute='Total Population')
             fig['data'].append({
                 'x': country_population['Market_Year'],
                 'y': country_population['Value'],
@@ -718,7 +865,30 @@ def update_line_chart(selected_commodity, selected_country, primary_attributes,
                 'marker': {'color': colors.get('Population', 'gold')},
                 'yaxis': 'y2'
             })
-    
+
+    # Add the precomputed forecast and its prediction interval for each selected series that has one
+    if 'forecast' in (forecast_toggle or []):
+        for attributes, yaxis in [(primary_attributes, 'y1'), (secondary_attributes, 'y2')]:
+            for attribute in attributes:
+                forecast = snapshot.forecasts.get((selected_commodity, selected_country, attribute))
+                if forecast is None:
+                    continue
+                years, values, lower, upper = forecast
+                color = colors.get(attribute, 'gray')
+                fig['data'].append({
+                    'x': years, 'y': lower, 'type': 'line', 'yaxis': yaxis,
+                    'line': {'width': 0}, 'showlegend': False, 'hoverinfo': 'skip'
+                })
+                fig['data'].append({
+                    'x': years, 'y': upper, 'type': 'line', 'yaxis': yaxis,
+                    'name': f'{attribute} interval', 'line': {'width': 0},
+                    'fill': 'tonexty', 'fillcolor': 'rgba(128, 128, 128, 0.2)'
+                })
+                fig['data'].append({
+                    'x': years, 'y': values, 'type': 'line', 'yaxis': yaxis,
+                    'name': f'{attribute} forecast', 'line': {'dash': 'dot', 'color': color}
+                })
+
     return fig
 
 
@@ -728,6 +898,7 @@ def update_line_chart(selected_commodity, selected_country, primary_attributes,
     [Input('toggle-table-button', 'n_clicks')],
     [State('table-container', 'style')]
 )
+@instrument
 def toggle_table_visibility(n_clicks, current_style):
     if n_clicks is None:
         n_clicks = 0
@@ -740,48 +911,94 @@ def toggle_table_visibility(n_clicks, current_style):
 @app.callback(
     Output('download-dataframe-csv', 'data'),
     [Input('export-csv-button', 'n_clicks')],
-    [State('commodity-dropdown', 'value'),
-     State('country-dropdown', 'value'),
-     State('year-dropdown', 'value')],
+    [State('selection-store', 'data')],
     prevent_initial_call=True
 )
-def generate_csv(n_clicks, selected_commodity, selected_country, selected_year):
-    # Filter data based on selections
-    filtered_data = data[(data['Commodity_Description'] == selected_commodity) & 
-                         (data['Country_Name'] == selected_country) &
-                         (data['Market_Year'] == selected_year)]
+@instrument
+def generate_csv(n_clicks, selection):
+    if selection is None:
+        return ''
+    snapshot = selection_snapshot(selection['version'])
+    selected_commodity, selected_country, selected_year = selection['commodity'], selection['country'], selection['year']
+    filtered_data, _ = balance_slice(snapshot.versions, selected_commodity, selected_country, selected_year)
     
     if filtered_data.empty:
         return ''
     
     return dcc.send_data_frame(filtered_data.to_csv, f"{selected_commodity}_{selected_country}_{selected_year}.csv")
 
-# Display table
+# Start a bulk export in the background
 @app.callback(
-    Output('table-container', 'children'),
-    [Input('commodity-dropdown', 'value'),
-     Input('country-dropdown', 'value'),
-     Input('year-dropdown', 'value')]
+    [Output('export-job', 'data'),
+     Output('export-progress-interval', 'disabled')],
+    [Input('bulk-export-button', 'n_clicks')],
+    [State('export-commodities', 'value'),
+     State('export-countries', 'value'),
+     State('export-first-year', 'value'),
+     State('export-last-year', 'value'),
+     State('export-format', 'value')],
+    prevent_initial_call=True
 )
-def update_table(selected_commodity, selected_country, selected_year):
-    filtered_data = data[(data['Commodity_Description'] == selected_commodity) & 
-                         (data['Country_Name'] == selected_country) &
-                         (data['Market_Year'] == selected_year)]
-    
-    if filtered_data.empty:
-        return html.Div('No data available for the selected combination.')
-    
-    return html.Table([
-        html.Thead(
-            html.Tr([html.Th(col) for col in filtered_data.columns])
-        ),
-        html.Tbody([
-            html.Tr([
-                html.Td(filtered_data.iloc[i][col]) for col in filtered_data.columns
-            ]) for i in range(len(filtered_data))
-        ])
-    ])
-
-# Run the app
+@instrument
+def start_bulk_export(n_clicks, commodities, countries, first_year, last_year, export_format):
+    snapshot = reloader.current
+    return start_export(snapshot.data_index, export_format, commodities, countries, first_year, last_year), False
+
+# Report the progress of the bulk export and link the file once it is written
+@app.callback(
+    [Output('export-status', 'children'),
+     Output('export-progress-interval', 'disabled', allow_duplicate=True)],
+    [Input('export-progress-interval', 'n_intervals')],
+    [State('export-job', 'data')],
+    prevent_initial_call=True
+)
+@instrument
+def update_export_status(n_intervals, job_id):
+    progress = read_progress(job_id)
+    if progress is None:
+        return html.Div('Export not found.'), True
+    if progress['state'] == 'running':
+        return html.Div([
+            html.Progress(value=str(progress['done']), max=str(max(progress['total'], 1))),
+            html.Span(f" {progress['rows']:,} rows written"),
+        ]), False
+    if progress['state'] == 'done':
+        return html.A(f"Download export ({progress['rows']:,} rows)", href=f'/exports/{job_id}'), True
+    if progress['state'] == 'empty':
+        return html.Div('No data available for the selected combination.'), True
+    return html.Div(f"Export failed: {progress.get('error')}"), True
+
+# Export the KPI table of every country, commodity and year
+@app.callback(
+    Output('download-kpi-csv', 'data'),
+    [Input('export-kpi-button', 'n_clicks')],
+    prevent_initial_call=True
+)
+@instrument
+def generate_kpi_csv(n_clicks):
+    snapshot = reloader.current
+    return dcc.send_data_frame(snapshot.kpis.to_csv, os.path.basename(PathKpi) + '.csv', index=False)
+
+# Display one page of the table, only while it is visible
+@app.callback(
+    [Output('data-table', 'data'),
+     Output('data-table', 'page_count')],
+    [Input('selection-store', 'data'),
+     Input('data-table', 'page_current'),
+     Input('data-table', 'page_size'),
+     Input('data-table', 'sort_by'),
+     Input('data-table', 'filter_query'),
+     Input('table-container', 'style')]
+)
+@instrument
+def update_table(selection, page_current, page_size, sort_by, filter_query, container_style):
+    if selection is None or (container_style or {}).get('display') == 'none':
+        raise dash.exceptions.PreventUpdate
+
+    snapshot = selection_snapshot(selection['version'])
+    filtered_data, _ = balance_slice(snapshot.versions, selection['commodity'], selection['country'], selection['year'])
+    return page(filtered_data, page_current, page_size, sort_by, filter_query)
+
+# Run the development server (set PSD_DEBUG=0 to turn off the debugger and reloader)
 if __name__ == '__main__':
-    app.run_server(debug=True, host='0.0.0.0')
+    app.run(debug=os.getenv('PSD_DEBUG', '1') == '1', host='0.0.0.0')
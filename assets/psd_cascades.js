@@ -0,0 +1,41 @@
+// Dropdown cascades of the balances page, run in the browser from the availability map
+// shipped by load_availability (Display_Module_2.py)
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    psd: {
+        // Commodities of the selected group and the group's default commodity
+        commodityOptions: function(group, availability) {
+            if (!availability) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            var commodities = group ? availability.groups[group] || [] : availability.all;
+            var options = commodities.map(function(commodity) {
+                return {label: commodity, value: commodity};
+            });
+            var value = group ? availability.defaults[group] || (commodities.length ? commodities[0] : 'Wheat') : 'Wheat';
+            return [options, value];
+        },
+
+        // Market years available for the selected commodity and country
+        yearOptions: function(commodity, country, availability) {
+            if (!availability) {
+                return window.dash_clientside.no_update;
+            }
+            var runs = (availability.years[commodity] || {})[country] || [];
+            var options = [];
+            runs.forEach(function(run) {
+                for (var year = run[0]; year <= run[1]; year++) {
+                    options.push({label: year, value: year});
+                }
+            });
+            return options;
+        },
+
+        // Latest available year
+        yearValue: function(options) {
+            if (!options || !options.length) {
+                return null;
+            }
+            return Math.max.apply(null, options.map(function(option) { return option.value; }));
+        }
+    }
+});
@@ -0,0 +1,46 @@
+# Production server of the dashboard: gunicorn -c gunicorn.conf.py Display_Module_2:server
+import gc
+import os
+import shutil
+import tempfile
+
+bind = os.getenv('PSD_BIND', '0.0.0.0:8050')
+
+# Workers are forked from a master that has already loaded the dataset and its indexes, so they
+# share those pages copy-on-write (the Arrow columns are memory-mapped and shared regardless)
+preload_app = True
+workers = int(os.getenv('PSD_WORKERS', 2 * (os.cpu_count() or 1)))
+worker_class = 'gthread'
+threads = int(os.getenv('PSD_THREADS', 4))
+
+timeout = int(os.getenv('PSD_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then; a fresh fork starts again from the shared pages of the master
+max_requests = int(os.getenv('PSD_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+
+# Each worker keeps its own callback metrics; they are stored per process in this directory (set before the
+# app is loaded) and summed by /metrics, whichever worker serves the scrape. By default it lives as long as the server.
+metrics_dir_owned = 'PSD_METRICS_DIR' not in os.environ
+os.environ.setdefault('PSD_METRICS_DIR', os.path.join(tempfile.gettempdir(), f'psd_metrics_{os.getpid()}'))
+
+
+def when_ready(server):
+    # Move the loaded objects out of the collector's reach so that collections in the
+    # workers do not write to (and copy) the pages shared with the master
+    gc.freeze()
+
+
+def worker_exit(server, worker):
+    # Store the last observations of a worker stopped by max_requests or a reload
+    import psd_metrics
+    psd_metrics.flush()
+
+
+def on_exit(server):
+    if metrics_dir_owned:
+        shutil.rmtree(os.environ['PSD_METRICS_DIR'], ignore_errors=True)
@@ -0,0 +1,182 @@
+"""Benchmark of the balances ETL (Data_4_module_2_all.py) on synthetic PS&D files.
+
+    # Write a synthetic psd_alldata.csv at 10x the size of the real file
+    python psd_benchmark.py generate --scale 10 --output ../data/psd_synthetic_10x.csv
+
+    # Time and memory-profile each stage, and record the output as the golden reference
+    python psd_benchmark.py run --source ../data/psd_synthetic_10x.csv --write-golden golden_10x.csv
+
+    # After a pipeline change: rerun and diff the output against the golden reference
+    python psd_benchmark.py run --source ../data/psd_synthetic_10x.csv --golden golden_10x.csv
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from psd_etl import COUNTRY_CODES, build_balances
+from psd_ingest import read_psd
+
+BasePath = os.path.dirname(os.path.abspath(__file__))
+
+# Order of magnitude of the row count of the USDA psd_alldata.csv bulk file (scale 1)
+REAL_ROW_COUNT = 2_000_000
+
+MARKET_YEARS = range(1960, 2025)
+
+# Balance attributes of the synthetic file: Attribute_Description → (Attribute_ID, Unit_ID, Unit_Description)
+SYNTHETIC_ATTRIBUTES = {
+    'Area Harvested': (4, 4, '(1000 HA)'),
+    'Beginning Stocks': (20, 8, '(1000 MT)'),
+    'Production': (28, 8, '(1000 MT)'),
+    'Imports': (57, 8, '(1000 MT)'),
+    'Total Supply': (86, 8, '(1000 MT)'),
+    'Exports': (88, 8, '(1000 MT)'),
+    'Domestic Consumption': (125, 8, '(1000 MT)'),
+    'Feed Dom. Consumption': (130, 8, '(1000 MT)'),
+    'FSI Consumption': (140, 8, '(1000 MT)'),
+    'Ending Stocks': (176, 8, '(1000 MT)'),
+    'Total Distribution': (178, 8, '(1000 MT)'),
+    'Yield': (184, 26, '(MT/HA)'),
+}
+
+# Keys of an output row and the measures compared against the golden reference
+OUTPUT_KEYS = ['Country_Code', 'Commodity_Code', 'Market_Year', 'Attribute_Description']
+OUTPUT_MEASURES = ['Value', 'Population']
+
+
+def generate_synthetic_psd(output_path, scale=1.0, seed=0):
+    """Write a synthetic psd_alldata-shaped CSV of about scale × REAL_ROW_COUNT rows.
+
+    Every commodity of unique_commodities.csv gets a balance for every market
+    year. The ETL's own COUNTRY_CODES come first, then the countries of
+    unique_countries.csv and then as many generated countries as needed to
+    reach the row count. The file is written one country at a time.
+    """
+    rng = np.random.default_rng(seed)
+    commodities = pd.read_csv(os.path.join(BasePath, 'unique_commodities.csv'))
+    countries = pd.read_csv(os.path.join(BasePath, 'unique_countries.csv'))
+
+    attributes = pd.DataFrame(
+        [(name, attribute_id, unit_id, unit) for name, (attribute_id, unit_id, unit) in SYNTHETIC_ATTRIBUTES.items()],
+        columns=['Attribute_Description', 'Attribute_ID', 'Unit_ID', 'Unit_Description'],
+    )
+    years = pd.DataFrame({'Market_Year': list(MARKET_YEARS)})
+    country_block = commodities.merge(years, how='cross').merge(attributes, how='cross')
+
+    n_countries = max(len(COUNTRY_CODES), int(round(scale * REAL_ROW_COUNT / len(country_block))))
+    country_list = [(code, f'Country {code}') for code in COUNTRY_CODES]
+    country_list += [(row.Country_Code, row.Country_Name) for row in countries.itertuples()
+                     if row.Country_Code not in COUNTRY_CODES]
+    country_list += [(f'X{i:05d}', f'Synthetic {i}') for i in range(max(0, n_countries - len(country_list)))]
+
+    columns = ['Commodity_Code', 'Commodity_Description', 'Country_Code', 'Country_Name', 'Market_Year', 'Calendar_Year',
+               'Month', 'Attribute_ID', 'Attribute_Description', 'Unit_ID', 'Unit_Description', 'Value']
+    for i, (country_code, country_name) in enumerate(country_list[:n_countries]):
+        block = country_block.copy()
+        block['Country_Code'] = country_code
+        block['Country_Name'] = country_name
+        block['Calendar_Year'] = 2024
+        block['Month'] = 6
+        block['Value'] = rng.gamma(2.0, 500.0, len(block)).round(1)
+        block[columns].to_csv(output_path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+
+    return n_countries * len(country_block)
+
+
+def run_pipeline(source_path, population_path, profile_memory=True):
+    """Run the ETL stages on source_path, returning the output and a per-stage report.
+
+    Each stage is timed; with profile_memory its peak traced allocation is
+    measured with tracemalloc (which slows the stages down).
+    """
+    report = []
+
+    def run_stage(name, function, *args):
+        if profile_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+        peak_mb = np.nan
+        if profile_memory:
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+        report.append({'stage': name, 'seconds': seconds, 'peak_mb': peak_mb, 'rows': len(result)})
+        return result
+
+    subset_df = run_stage('read_psd', read_psd, source_path, COUNTRY_CODES)
+    population_df = run_stage('read_population', pd.read_csv, population_path)
+    merged_df = build_balances(subset_df, population_df, run_stage=run_stage)
+
+    report = pd.DataFrame(report)
+    report.loc[len(report)] = {'stage': 'total', 'seconds': report['seconds'].sum(),
+                               'peak_mb': report['peak_mb'].max(), 'rows': len(merged_df)}
+    return merged_df, report
+
+
+def compare_to_golden(output_df, golden_df, rtol=1e-6, atol=1e-9):
+    """Diff an ETL output against a golden reference.
+
+    Returns the rows whose keys exist on one side only or whose Value or
+    Population differ beyond the tolerance; an empty frame means equivalent.
+    """
+    merged = golden_df[OUTPUT_KEYS + OUTPUT_MEASURES].merge(
+        output_df[OUTPUT_KEYS + OUTPUT_MEASURES], on=OUTPUT_KEYS, how='outer',
+        suffixes=('_golden', '_output'), indicator=True,
+    )
+    mismatch = merged['_merge'] != 'both'
+    for measure in OUTPUT_MEASURES:
+        mismatch |= ~np.isclose(merged[f'{measure}_golden'].astype(float), merged[f'{measure}_output'].astype(float),
+                                rtol=rtol, atol=atol, equal_nan=True)
+    return merged[mismatch]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help='write a synthetic PS&D file')
+    generate_parser.add_argument('--scale', type=float, default=1.0, help='size relative to the real file (1, 10, 100)')
+    generate_parser.add_argument('--output', required=True)
+    generate_parser.add_argument('--seed', type=int, default=0)
+
+    run_parser = subparsers.add_parser('run', help='time the ETL stages and check the output')
+    run_parser.add_argument('--source', required=True, help='PS&D CSV file to process')
+    run_parser.add_argument('--population', default=os.path.join(BasePath, 'Population.csv'))
+    run_parser.add_argument('--golden', help='golden output CSV to diff the output against')
+    run_parser.add_argument('--write-golden', help='write the output as the golden reference CSV')
+    run_parser.add_argument('--rtol', type=float, default=1e-6)
+    run_parser.add_argument('--no-memory', action='store_true', help='time the stages without tracemalloc')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        rows = generate_synthetic_psd(args.output, scale=args.scale, seed=args.seed)
+        print(f"Synthetic PS&D file with {rows} rows created: {args.output}")
+        return 0
+
+    merged_df, report = run_pipeline(args.source, args.population, profile_memory=not args.no_memory)
+    print(report.to_string(index=False, float_format=lambda x: f'{x:.3f}'))
+    print(f"Max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+    if args.write_golden:
+        merged_df.to_csv(args.write_golden, index=False)
+        print(f"Golden output created: {args.write_golden}")
+
+    if args.golden:
+        mismatches = compare_to_golden(merged_df, pd.read_csv(args.golden), rtol=args.rtol)
+        if not mismatches.empty:
+            print(f"{len(mismatches)} rows differ from the golden output {args.golden}:")
+            print(mismatches.head(20).to_string(index=False))
+            return 1
+        print(f"Output matches the golden output {args.golden}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import collections
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+
+# Flask-Caching is optional: without it only the per-process cache is used
+try:
+    from flask_caching import Cache
+except ImportError:
+    Cache = None
+
+# Shared on-disk cache of the gunicorn workers; entries expire after CACHE_TIMEOUT seconds and
+# the oldest are pruned beyond CACHE_THRESHOLD entries
+CACHE_DIR = os.getenv('PSD_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'psd_cache'))
+CACHE_TIMEOUT = int(os.getenv('PSD_CACHE_TIMEOUT', 24 * 3600))
+CACHE_THRESHOLD = int(os.getenv('PSD_CACHE_THRESHOLD', 2000))
+
+# Entries kept in memory by each process in front of the shared cache
+LOCAL_CACHE_SIZE = int(os.getenv('PSD_LOCAL_CACHE_SIZE', 256))
+
+
+def init_cache(server):
+    """Attach the shared on-disk cache to the Flask server, or return None without Flask-Caching."""
+    if Cache is None:
+        return None
+    return Cache(server, config={
+        'CACHE_TYPE': 'FileSystemCache',
+        'CACHE_DIR': CACHE_DIR,
+        'CACHE_DEFAULT_TIMEOUT': CACHE_TIMEOUT,
+        'CACHE_THRESHOLD': CACHE_THRESHOLD,
+    })
+
+
+def memoize(cache, data_version):
+    """Memoize a callback on its inputs and the current data version.
+
+    data_version() is called on every invocation and is part of the key, so
+    entries computed from a previous dataset are never served once the data
+    is rebuilt. Results are looked up in a bounded in-process LRU first and
+    then in the shared cache (if any), so a selection computed by one worker
+    is reused by the others.
+    """
+    def decorator(callback):
+        local = collections.OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(callback)
+        def wrapper(*args):
+            key = f'{callback.__name__}:' + hashlib.sha1(repr((data_version(), args)).encode()).hexdigest()
+
+            with lock:
+                if key in local:
+                    local.move_to_end(key)
+                    return local[key]
+
+            result = cache.get(key) if cache is not None else None
+            if result is None:
+                result = callback(*args)
+                if cache is not None:
+                    cache.set(key, result)
+
+            with lock:
+                local[key] = result
+                if len(local) > LOCAL_CACHE_SIZE:
+                    local.popitem(last=False)
+            return result
+
+        return wrapper
+
+    return decorator
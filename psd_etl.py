@@ -0,0 +1,207 @@
+import pandas as pd
+
+# PS&D country codes of the balances and their replacements (AL/AG → DZ, TS → TN, MO → MA, MU → OM)
+COUNTRY_CODES = ['MO', 'EG', 'LY', 'TS', 'AG', 'MR', 'JO', 'MU']
+COUNTRY_CODE_REPLACEMENTS = {'AG': 'DZ', 'TS': 'TN', 'MO': 'MA', 'MU': 'OM'}
+
+# Regional aggregates: code → (name, member country codes)
+REGIONS = {
+    'NN':  ('North Africa', ['MA', 'EG', 'LY', 'TN', 'DZ']),
+    'SNE': ('SNE Countries', ['MR', 'MA', 'DZ', 'LY', 'TN']),
+}
+
+# Countries and regions kept in the published output
+FINAL_COUNTRIES = ['MR', 'MA', 'LY', 'DZ', 'TN', 'EG', 'JO', 'OM', 'NN', 'SNE']
+
+# Keys of a balance row apart from the commodity
+AGG_COLUMNS = ['Country_Code', 'Country_Name', 'Market_Year', 'Attribute_ID', 'Attribute_Description', 'Unit_ID', 'Unit_Description']
+
+# Derived ratio attributes: name → (Attribute_ID, numerator, denominator, Unit_ID, Unit_Description)
+# Yield is Production / Area Harvested with the unit_id 26 and unit_description (MT/HA)
+DERIVED_ATTRIBUTES = {
+    'Yield': (184, 'Production', 'Area Harvested', 26, '(MT/HA)'),
+}
+
+# Commodity aggregates: code → (description, member codes, divisor)
+# Members may be other aggregate codes (Coarse Grains inside Cereals); they are
+# expanded to their leaf commodities. The divisor applies to the leaf values.
+COMMODITY_AGGREGATES = {
+    490000:  ('Coarse Grains',        [430000, 440000, 459100, 452000, 459200], 1),
+    400000:  ('Cereals',              [490000, 422110, 410000], 1),
+    2200000: ('Oilseeds, Total',      [2223000, 2221000, 2226000, 2222000, 2224000], 1),
+    4200000: ('Vegetable Oils, Total', [4233000, 4235000, 4243000, 4239100, 4232000, 4236000], 1),
+    810000:  ('Oilmeals, Total',      [813300, 814200, 813200, 813600, 813100], 1),
+    570000:  ('Fresh Fruit',          [571120, 579220, 574000, 571220, 575100], 1000),
+    570001:  ('Nuts, Total',          [577901, 577907, 577400], 1000),
+    110000:  ('Meat, Total',          [111000, 115000, 113000, 114200], 1),
+}
+
+
+def leaf_members(code, aggregates=COMMODITY_AGGREGATES):
+    """Return the leaf commodity codes of an aggregate, expanding nested aggregates."""
+    leaves = []
+    for member in aggregates[code][1]:
+        if member in aggregates:
+            leaves.extend(leaf_members(member, aggregates))
+        else:
+            leaves.append(member)
+    return leaves
+
+
+def aggregate_commodities(df, codes=None, aggregates=COMMODITY_AGGREGATES):
+    """Append the commodity aggregates to df in a single pass.
+
+    All aggregates (or only those in codes) are computed with one join of the
+    rows against the aggregate membership table and one groupby, and appended
+    to df with a single concat.
+    """
+    codes = list(aggregates) if codes is None else codes
+    membership = pd.DataFrame(
+        [(leaf, code, aggregates[code][0], aggregates[code][2]) for code in codes for leaf in leaf_members(code, aggregates)],
+        columns=['Commodity_Code', 'Aggregate_Code', 'Aggregate_Description', 'Divisor'],
+    )
+
+    members_df = df[AGG_COLUMNS + ['Commodity_Code', 'Value']].merge(membership, on='Commodity_Code')
+    members_df['Value'] = members_df['Value'] / members_df['Divisor']
+
+    agg_df = members_df.groupby(AGG_COLUMNS + ['Aggregate_Code', 'Aggregate_Description'])['Value'].sum().reset_index()
+    agg_df = agg_df.rename(columns={'Aggregate_Code': 'Commodity_Code', 'Aggregate_Description': 'Commodity_Description'})
+    return pd.concat([df, agg_df], ignore_index=True)
+
+
+def clean_countries(df, replacements=COUNTRY_CODE_REPLACEMENTS):
+    """Normalize the country codes and drop the published yields, which are recalculated."""
+    df = df.copy()
+    # Strip any whitespace from the Country_Code column to avoid hidden characters
+    df['Country_Code'] = df['Country_Code'].str.strip()
+    df['Country_Code'] = df['Country_Code'].replace(replacements)
+    # Eliminate the observations for Attribute_ID=184, Attribute_Description=Yield
+    return df[df['Attribute_ID'] != 184]
+
+
+def country_code_replacements(psd_countries, population_countries):
+    """Map the PS&D country codes to the population codes of the countries with the same name.
+
+    Used by the global build in place of COUNTRY_CODE_REPLACEMENTS, from
+    unique_countries.csv (Country_Name, Country_Code) and
+    unique_countries_pop.csv (Country, Country_Code). A replacement whose
+    target is the code of another, unreplaced PS&D country is skipped, so that
+    two countries never share a code.
+    """
+    matched = psd_countries.merge(population_countries, left_on='Country_Name', right_on='Country', suffixes=('', '_Population'))
+    matched = matched[(matched['Country_Code_Population'] != '') & (matched['Country_Code'] != matched['Country_Code_Population'])]
+    replacements = dict(zip(matched['Country_Code'], matched['Country_Code_Population']))
+    while True:
+        kept_codes = set(psd_countries['Country_Code']) - set(replacements)
+        safe = {code: target for code, target in replacements.items() if target not in kept_codes}
+        if safe == replacements:
+            return replacements
+        replacements = safe
+
+
+def region_rows(df, regions=REGIONS):
+    """Return the regional aggregates (North Africa 'NN', 'SNE', ...) of every commodity, one frame per region."""
+    country_agg_columns = ['Commodity_Code', 'Commodity_Description', 'Market_Year', 'Attribute_ID', 'Attribute_Description', 'Unit_ID', 'Unit_Description']
+    region_dfs = []
+    for region_code, (region_name, countries) in regions.items():
+        region_df = df[df['Country_Code'].isin(countries)].groupby(country_agg_columns)['Value'].sum().reset_index()
+        region_df['Country_Code'] = region_code
+        region_df['Country_Name'] = region_name
+        region_dfs.append(region_df)
+    return region_dfs
+
+
+def aggregate_regions(df, regions=REGIONS):
+    """Append the regional aggregates (North Africa 'NN', 'SNE', ...) of every commodity."""
+    df = pd.concat([df] + region_rows(df, regions), ignore_index=True)
+
+    # Ensure uniqueness to avoid duplicates
+    return df.drop_duplicates(subset=['Country_Code', 'Country_Name', 'Commodity_Code', 'Commodity_Description', 'Market_Year', 'Attribute_ID', 'Attribute_Description'])
+
+
+def add_derived_attributes(df, derived=DERIVED_ATTRIBUTES):
+    """Append the ratio attributes of DERIVED_ATTRIBUTES, including for the country and commodity aggregates.
+
+    Only the numerator and denominator series are aligned on their keys (an
+    outer join, so a series missing one side yields NaN), and all derived
+    attributes are appended with a single concat.
+    """
+    series_keys = ['Country_Code', 'Country_Name', 'Commodity_Code', 'Commodity_Description', 'Market_Year']
+    values = df.set_index(series_keys)['Value']
+    attributes = df['Attribute_Description'].to_numpy()
+
+    derived_dfs = []
+    for name, (attribute_id, numerator, denominator, unit_id, unit_description) in derived.items():
+        numerator_values = values[attributes == numerator]
+        denominator_values = values[attributes == denominator]
+        if numerator_values.empty and denominator_values.empty:
+            continue
+        numerator_values, denominator_values = numerator_values.align(denominator_values, join='outer')
+
+        derived_df = (numerator_values / denominator_values).rename('Value').reset_index()
+        derived_df['Attribute_Description'] = name
+        derived_df['Attribute_ID'] = attribute_id
+        derived_df['Unit_ID'] = unit_id
+        derived_df['Unit_Description'] = unit_description
+        derived_dfs.append(derived_df)
+
+    return pd.concat([df] + derived_dfs, ignore_index=True)
+
+
+def population_dimension(population_df, regions=REGIONS):
+    """Index the population by (Country_Code, Market_Year), including the regional totals.
+
+    The regional totals are summed over the same REGIONS members as the
+    regional values of aggregate_regions.
+    """
+    population = population_df.dropna(subset=['Country_Code']).set_index(['Country_Code', 'Market_Year'])['Population']
+    country_codes = population.index.get_level_values('Country_Code')
+
+    region_totals = []
+    for region_code, (region_name, countries) in regions.items():
+        totals = population[country_codes.isin(countries)].groupby(level='Market_Year').sum()
+        totals.index = pd.MultiIndex.from_product([[region_code], totals.index], names=population.index.names)
+        region_totals.append(totals)
+    return pd.concat([population] + region_totals).sort_index()
+
+
+def add_population(df, population):
+    """Attach the Population of each row's Country_Code and Market_Year with a single keyed lookup."""
+    keys = pd.MultiIndex.from_arrays([df['Country_Code'], df['Market_Year'].astype('int64')])
+    return df.assign(Population=population.reindex(keys).to_numpy())
+
+
+def finalize(df, countries=FINAL_COUNTRIES):
+    """Keep the published countries (all of them if None), make the rows unique and sort them."""
+    # Reapply the country filter to ensure only the specified countries are included
+    if countries is not None:
+        df = df[df['Country_Code'].isin(countries)]
+
+    # Aggregate to ensure uniqueness
+    agg_columns = ['Country_Code', 'Country_Name', 'Commodity_Code', 'Commodity_Description', 'Market_Year', 'Attribute_Description']
+    df = df.groupby(agg_columns, as_index=False).agg({'Value': 'sum', 'Population': 'first', 'Attribute_ID': 'first', 'Unit_ID': 'first', 'Unit_Description': 'first'})
+
+    # Sort the DataFrame by Commodity_Code, Country_Code, and Market_Year
+    return df.sort_values(by=['Commodity_Code', 'Country_Code', 'Market_Year'])
+
+
+def build_balances(subset_df, population_df, run_stage=None, replacements=COUNTRY_CODE_REPLACEMENTS,
+                   countries=FINAL_COUNTRIES):
+    """Run every stage of the balances ETL on the PS&D rows read for COUNTRY_CODES.
+
+    run_stage(name, function, *args) is called for every stage if given; it
+    must return function(*args). The benchmark uses it to time each stage.
+    The global build passes the replacements of every PS&D country and
+    countries=None to publish them all.
+    """
+    if run_stage is None:
+        def run_stage(name, function, *args):
+            return function(*args)
+
+    df = run_stage('clean_countries', clean_countries, subset_df, replacements)
+    df = run_stage('aggregate_commodities', aggregate_commodities, df)
+    df = run_stage('aggregate_regions', aggregate_regions, df)
+    df = run_stage('add_derived_attributes', add_derived_attributes, df)
+    population = run_stage('population_dimension', population_dimension, population_df)
+    df = run_stage('add_population', add_population, df, population)
+    return run_stage('finalize', finalize, df, countries)
@@ -0,0 +1,206 @@
+import gzip
+import json
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import flask
+
+# pyarrow is optional: without it only the gzip CSV format is offered
+try:
+    import pyarrow as pa
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+# Directory of the export files and of their progress records, shared by the workers;
+# finished exports are removed after EXPORT_TIMEOUT seconds
+EXPORT_DIR = os.getenv('PSD_EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'psd_exports'))
+EXPORT_TIMEOUT = int(os.getenv('PSD_EXPORT_TIMEOUT', 24 * 3600))
+
+# A running export whose worker has not reported progress for EXPORT_STALE seconds is failed: the
+# worker was recycled (max_requests) or crashed and took the export thread with it
+EXPORT_STALE = int(os.getenv('PSD_EXPORT_STALE', 600))
+
+# format → (file extension, mimetype)
+EXPORT_FORMATS = {
+    'csv.gz': ('csv.gz', 'application/gzip'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def available_formats():
+    return [fmt for fmt in EXPORT_FORMATS if fmt != 'parquet' or pa is not None]
+
+
+def _progress_path(job_id):
+    return os.path.join(EXPORT_DIR, job_id + '.json')
+
+
+def export_path(job_id, fmt):
+    return os.path.join(EXPORT_DIR, f'{job_id}.{EXPORT_FORMATS[fmt][0]}')
+
+
+def _write_progress(job_id, **progress):
+    # Replaced atomically so a worker polling the job never reads a partial record;
+    # the heartbeat and owner of a running job tell whether its worker is still alive
+    progress.update(host=socket.gethostname(), pid=os.getpid(), heartbeat=time.time())
+    tmp_path = _progress_path(job_id) + f'.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, _progress_path(job_id))
+
+
+def _worker_stopped(progress):
+    """Whether the worker running an export stopped: its process is gone or its heartbeat is stale."""
+    if time.time() - progress.get('heartbeat', 0) > EXPORT_STALE:
+        return True
+    if progress.get('host') != socket.gethostname():
+        return False
+    try:
+        os.kill(progress['pid'], 0)
+    except ProcessLookupError:
+        return True
+    except (KeyError, OSError):
+        pass
+    return False
+
+
+def read_progress(job_id):
+    """Return the progress record of an export job, or None for an unknown job.
+
+    A job left running by a worker that stopped is reported, and recorded,
+    as failed, and its partial file removed.
+    """
+    if not _JOB_ID.match(job_id or ''):
+        return None
+    try:
+        with open(_progress_path(job_id)) as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if progress['state'] == 'running' and _worker_stopped(progress):
+        try:
+            os.remove(export_path(job_id, progress['format']) + '.tmp')
+        except OSError:
+            pass
+        progress = dict(progress, state='failed', error='the export worker stopped before the export was complete')
+        _write_progress(job_id, **{key: progress[key] for key in ['state', 'format', 'done', 'total', 'rows', 'error']})
+    return progress
+
+
+def _prune_exports():
+    now = time.time()
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > EXPORT_TIMEOUT:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def export_chunks(data_index, commodities=None, countries=None, first_year=None, last_year=None):
+    """Yield the selected rows one (commodity, country) block at a time.
+
+    Empty commodity or country selections select everything. Only one block
+    is held in memory at a time, whatever the size of the selection.
+    """
+    for commodity, country in data_index.pairs(commodities, countries):
+        block = data_index.slice(commodity, country)
+        if first_year is not None:
+            block = block[block['Market_Year'] >= first_year]
+        if last_year is not None:
+            block = block[block['Market_Year'] <= last_year]
+        yield block
+
+
+def write_export(chunks, path, fmt, on_chunk=None):
+    """Stream the chunks to a gzip CSV or Parquet file and return the number of rows written.
+
+    The file is written under a temporary name and renamed when complete.
+    on_chunk(rows) is called after each chunk, for progress reporting.
+    """
+    tmp_path = path + '.tmp'
+    rows = 0
+    if fmt == 'parquet':
+        writer = None
+        try:
+            for chunk in chunks:
+                if chunk.empty:
+                    pass
+                elif writer is None:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    writer = pa.parquet.ParquetWriter(tmp_path, table.schema, compression='zstd')
+                    writer.write_table(table)
+                else:
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False))
+                rows += len(chunk)
+                if on_chunk is not None:
+                    on_chunk(rows)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            return 0
+    else:
+        with gzip.open(tmp_path, 'wt', newline='') as f:
+            for chunk in chunks:
+                # Empty blocks are skipped, so that the header is written with the first rows
+                if not chunk.empty:
+                    chunk.to_csv(f, header=rows == 0, index=False)
+                rows += len(chunk)
+                if on_chunk is not None:
+                    on_chunk(rows)
+    os.replace(tmp_path, path)
+    return rows
+
+
+def start_export(data_index, fmt, commodities=None, countries=None, first_year=None, last_year=None):
+    """Start a bulk export in a background thread and return its job id.
+
+    The progress of the job (blocks done out of total, rows written, state)
+    is recorded next to the export file, so any worker can report it and
+    serve the file once it is done, or report it failed if the thread's
+    worker stops before the end (see read_progress).
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    _prune_exports()
+
+    job_id = uuid.uuid4().hex
+    total = len(data_index.pairs(commodities, countries))
+    _write_progress(job_id, state='running', format=fmt, done=0, total=total, rows=0)
+
+    def run():
+        done = [0]
+
+        def on_chunk(rows):
+            done[0] += 1
+            _write_progress(job_id, state='running', format=fmt, done=done[0], total=total, rows=rows)
+
+        try:
+            chunks = export_chunks(data_index, commodities, countries, first_year, last_year)
+            rows = write_export(chunks, export_path(job_id, fmt), fmt, on_chunk)
+            _write_progress(job_id, state='done' if rows else 'empty', format=fmt, done=total, total=total, rows=rows)
+        except Exception as e:
+            _write_progress(job_id, state='failed', format=fmt, done=done[0], total=total, rows=0, error=str(e))
+
+    threading.Thread(target=run, name=f'psd-export-{job_id}', daemon=True).start()
+    return job_id
+
+
+def register_export_endpoint(server, path='/exports'):
+    """Serve finished export files at path/<job id> on the Flask server."""
+    @server.route(f'{path}/<job_id>')
+    def download_export(job_id):
+        progress = read_progress(job_id)
+        if progress is None or progress['state'] != 'done':
+            flask.abort(404)
+        fmt = progress['format']
+        return flask.send_file(export_path(job_id, fmt), mimetype=EXPORT_FORMATS[fmt][1], as_attachment=True,
+                               download_name=f'psd_export.{EXPORT_FORMATS[fmt][0]}')
@@ -0,0 +1,179 @@
+"""Forecasts of the balance series, fitted ahead of time for the time-series chart.
+
+    python psd_forecast.py [--dataset psd_north_africa] [--workers N]
+
+reads the published balances and writes <dataset>_forecast (.arrow and .csv):
+one row per forecast year of every (commodity, country, attribute) series in
+FORECAST_ATTRIBUTES, with the prediction interval. The series are fitted in a
+process pool. Each series is keyed by a hash of its content and of the model
+settings, and forecasts of unchanged series are carried over from the previous
+artifact instead of being refit.
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+import statistics
+import numpy as np
+import pandas as pd
+
+from psd_store import data_version, load_dataset, write_artifacts
+
+
+# Series that get a forecast
+FORECAST_ATTRIBUTES = ['Production', 'Yield', 'Imports']
+
+# Years forecast after the last observed year, coverage of the prediction interval
+# and observed years needed to fit a series
+FORECAST_HORIZON = int(os.getenv('PSD_FORECAST_HORIZON', 10))
+INTERVAL_WIDTH = 0.8
+MIN_YEARS = 10
+
+SERIES_KEYS = ['Commodity_Description', 'Country_Name', 'Attribute_Description']
+FORECAST_COLUMNS = SERIES_KEYS + ['Market_Year', 'Forecast', 'Lower', 'Upper', 'Series_Hash', 'Model']
+
+
+# Prophet is preferred; scikit-learn's BayesianRidge on the year is the fallback. They are imported only
+# to fit (see model_class), so readers of the forecast artifact such as the dashboard never load them
+MODEL_MODULES = {'prophet': 'prophet', 'bayesian_ridge': 'sklearn'}
+
+
+def default_model():
+    for model, module in MODEL_MODULES.items():
+        if importlib.util.find_spec(module) is not None:
+            return model
+    return None
+
+
+def model_class(model):
+    if model == 'prophet':
+        from prophet import Prophet
+        return Prophet
+    from sklearn.linear_model import BayesianRidge
+    return BayesianRidge
+
+
+def forecast_path(base_path):
+    return base_path + '_forecast'
+
+
+def series_hash(keys, years, values, model, horizon=FORECAST_HORIZON):
+    """Hash the keys and observations of a series together with the settings of its forecast."""
+    digest = hashlib.sha1(repr((keys, model, horizon, INTERVAL_WIDTH)).encode())
+    digest.update(np.asarray(years, dtype='int64').tobytes())
+    digest.update(np.asarray(values, dtype='float64').tobytes())
+    return digest.hexdigest()
+
+
+def fit_series(task):
+    """Fit one series and return (series hash, future years, forecast, lower, upper); runs in a pool worker."""
+    key, years, values, model, horizon = task
+    future_years = np.arange(years[-1] + 1, years[-1] + horizon + 1)
+
+    if model == 'prophet':
+        history = pd.DataFrame({'ds': pd.to_datetime(years.astype(str), format='%Y'), 'y': values})
+        fitted = model_class(model)(yearly_seasonality=False, weekly_seasonality=False, daily_seasonality=False,
+                         interval_width=INTERVAL_WIDTH).fit(history)
+        future = pd.DataFrame({'ds': pd.to_datetime(future_years.astype(str), format='%Y')})
+        prediction = fitted.predict(future)
+        forecast, lower, upper = (prediction[col].to_numpy() for col in ['yhat', 'yhat_lower', 'yhat_upper'])
+    else:
+        fitted = model_class(model)().fit(years.reshape(-1, 1).astype(float), values)
+        forecast, std = fitted.predict(future_years.reshape(-1, 1).astype(float), return_std=True)
+        z = statistics.NormalDist().inv_cdf(0.5 + INTERVAL_WIDTH / 2)
+        lower, upper = forecast - z * std, forecast + z * std
+
+    return key, future_years, forecast, lower, upper
+
+
+def series_tasks(df, model, horizon=FORECAST_HORIZON, attributes=FORECAST_ATTRIBUTES):
+    """Return {series keys: (series hash, years, values)} of the series with at least MIN_YEARS observations."""
+    df = df[df['Attribute_Description'].isin(attributes)]
+    df = df.astype({col: str for col in SERIES_KEYS})
+    series = {}
+    for keys, group in df.groupby(SERIES_KEYS, sort=False):
+        group = group.groupby('Market_Year')['Value'].sum(min_count=1).dropna().sort_index()
+        group = group[np.isfinite(group.to_numpy())]
+        if len(group) < MIN_YEARS:
+            continue
+        years, values = group.index.to_numpy(dtype='int64'), group.to_numpy(dtype='float64')
+        series[keys] = (series_hash(keys, years, values, model, horizon), years, values)
+    return series
+
+
+def build_forecasts(df, previous=None, model=None, workers=None, horizon=FORECAST_HORIZON):
+    """Forecast every series of df, reusing the rows of previous (the last artifact) whose hash is unchanged.
+
+    Returns the forecast table and the number of series fitted.
+    """
+    model = model or default_model()
+    if model is None:
+        raise RuntimeError('neither prophet nor scikit-learn is installed')
+
+    series = series_tasks(df, model, horizon)
+    reused = []
+    if previous is not None and not previous.empty:
+        previous = previous.astype({'Series_Hash': str})
+        reused.append(previous[previous['Series_Hash'].isin({key for key, _, _ in series.values()})])
+    known = set(reused[0]['Series_Hash']) if reused else set()
+
+    keys_by_hash = {key: keys for keys, (key, _, _) in series.items()}
+    tasks = [(key, years, values, model, horizon) for key, years, values in series.values() if key not in known]
+
+    fitted = []
+    if tasks:
+        # Imported here once, so the forked workers inherit the model module
+        model_class(model)
+        # Fork where available: the ETL script that calls this has no __main__ guard to survive a re-import
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            chunksize = max(len(tasks) // (4 * (workers or os.cpu_count() or 1)), 1)
+            for key, future_years, forecast, lower, upper in pool.map(fit_series, tasks, chunksize=chunksize):
+                commodity, country, attribute = keys_by_hash[key]
+                fitted.append(pd.DataFrame({
+                    'Commodity_Description': commodity, 'Country_Name': country, 'Attribute_Description': attribute,
+                    'Market_Year': future_years, 'Forecast': forecast, 'Lower': lower, 'Upper': upper,
+                    'Series_Hash': key, 'Model': model,
+                }))
+
+    frames = [frame for frame in reused + fitted if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=FORECAST_COLUMNS), len(tasks)
+    forecasts = pd.concat(frames, ignore_index=True)[FORECAST_COLUMNS]
+    return forecasts.sort_values(SERIES_KEYS + ['Market_Year'], ignore_index=True), len(tasks)
+
+
+def forecast_table(forecasts):
+    """Index a forecast artifact by series: {(commodity, country, attribute): (years, forecast, lower, upper)}."""
+    table = {}
+    for keys, group in forecasts.groupby(SERIES_KEYS, sort=False, observed=True):
+        table[tuple(str(key) for key in keys)] = tuple(group[col].to_numpy() for col in ['Market_Year', 'Forecast', 'Lower', 'Upper'])
+    return table
+
+
+def update_forecasts(df, base_path, model=None, workers=None):
+    """Forecast the balances df of the artifact at base_path and write base_path_forecast; return the written files."""
+    output_path = forecast_path(base_path)
+    previous = load_dataset(output_path) if data_version(output_path) is not None else None
+
+    forecasts, n_fitted = build_forecasts(df, previous, model, workers)
+    print(f"Fitted {n_fitted} series, {forecasts[SERIES_KEYS].drop_duplicates().shape[0] - n_fitted} unchanged")
+    return write_artifacts(forecasts, output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Forecast the balance series of a published dataset.')
+    parser.add_argument('--dataset', default='psd_north_africa', help='base name of the balances artifact')
+    parser.add_argument('--workers', type=int, default=None, help='fitting processes (default: all cores)')
+    parser.add_argument('--model', choices=['prophet', 'bayesian_ridge'], default=None)
+    args = parser.parse_args()
+
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.dataset)
+    for written_path in update_forecasts(load_dataset(base_path), base_path, args.model, args.workers):
+        print(f"Output file created: {written_path}")
+
+
+if __name__ == '__main__':
+    main()
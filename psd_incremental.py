@@ -0,0 +1,104 @@
+import os
+import pickle
+import pandas as pd
+
+import psd_etl
+
+# Keys of the input partitions compared between two runs
+PARTITION_KEYS = ['Country_Code', 'Commodity_Code', 'Market_Year']
+
+# File holding the previous run's input, population and output
+STATE_FILE = 'psd_incremental_state.pkl'
+
+
+def config_fingerprint():
+    """Fingerprint of the ETL definitions; a change forces a full rebuild."""
+    return repr((psd_etl.COUNTRY_CODES, psd_etl.COUNTRY_CODE_REPLACEMENTS, psd_etl.REGIONS,
+                 psd_etl.FINAL_COUNTRIES, psd_etl.COMMODITY_AGGREGATES))
+
+
+def partition_hashes(df):
+    """Return an order-independent content hash per (country, commodity, market year) partition."""
+    row_hashes = pd.util.hash_pandas_object(df, index=False)
+    return row_hashes.groupby([df[key] for key in PARTITION_KEYS]).sum()
+
+
+def changed_partitions(previous_df, subset_df):
+    """Return the partition keys added, removed or modified between two inputs."""
+    previous_hashes = partition_hashes(previous_df)
+    current_hashes = partition_hashes(subset_df)
+    previous_hashes, current_hashes = previous_hashes.align(current_hashes)
+    return current_hashes.index[previous_hashes.ne(current_hashes)]
+
+
+def dependent_commodities(codes, aggregates=psd_etl.COMMODITY_AGGREGATES):
+    """Return the commodity codes to recompute when the given commodities change.
+
+    This is the closure of the changed commodities under aggregate membership:
+    every aggregate containing one of them and all the other leaves of those
+    aggregates, since the aggregates must be rebuilt from all their members.
+    """
+    leaves = set(codes)
+    affected_aggregates = set()
+    while True:
+        new_aggregates = {code for code in aggregates if leaves & set(psd_etl.leaf_members(code, aggregates))}
+        if new_aggregates <= affected_aggregates:
+            return leaves | affected_aggregates
+        affected_aggregates |= new_aggregates
+        for code in new_aggregates:
+            leaves |= set(psd_etl.leaf_members(code, aggregates))
+
+
+def load_state(state_path):
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_state(state_path, subset_df, population_df, merged_df):
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'config': config_fingerprint(), 'input': subset_df, 'population': population_df, 'output': merged_df}, f)
+    os.replace(tmp_path, state_path)
+
+
+def build_balances_incremental(subset_df, population_df, state_path):
+    """Build the balances, recomputing only the partitions changed since the previous run.
+
+    The partitions of subset_df are compared with the input stored in state_path.
+    For the changed (country, commodity, market year) partitions, the dependent
+    commodities (see dependent_commodities) are recomputed for the changed
+    market years across all countries, which also refreshes the regional rows
+    and yields, and patched into the previous output. Falls back to a full build
+    when there is no usable state or when the population data or the ETL
+    definitions changed. Returns the output and the number of changed partitions
+    (None for a full build).
+    """
+    state = load_state(state_path)
+    if (state is None or state['config'] != config_fingerprint()
+            or not state['population'].equals(population_df)):
+        merged_df = psd_etl.build_balances(subset_df, population_df)
+        save_state(state_path, subset_df, population_df, merged_df)
+        return merged_df, None
+
+    changed = changed_partitions(state['input'], subset_df)
+    if len(changed) == 0:
+        return state['output'], 0
+
+    codes = dependent_commodities(changed.get_level_values('Commodity_Code').unique())
+    years = changed.get_level_values('Market_Year').unique()
+
+    scope_df = subset_df[subset_df['Commodity_Code'].isin(codes) & subset_df['Market_Year'].isin(years)]
+    patch_df = psd_etl.build_balances(scope_df, population_df)
+
+    previous_df = state['output']
+    kept_df = previous_df[~(previous_df['Commodity_Code'].isin(codes) & previous_df['Market_Year'].isin(years))]
+
+    # Same ordering as a full build: unique keys in groupby order, then sorted by commodity, country and year
+    merged_df = pd.concat([kept_df, patch_df], ignore_index=True)
+    merged_df = merged_df.sort_values(['Country_Code', 'Country_Name', 'Commodity_Code', 'Commodity_Description', 'Market_Year', 'Attribute_Description'])
+    merged_df = merged_df.sort_values(by=['Commodity_Code', 'Country_Code', 'Market_Year']).reset_index(drop=True)
+
+    save_state(state_path, subset_df, population_df, merged_df)
+    return merged_df, len(changed)
@@ -0,0 +1,145 @@
+import numpy as np
+
+from psd_metrics import record_rows
+
+
+def consecutive_runs(years):
+    """Return the runs of consecutive years of a sorted array of unique years as [[first, last], ...]."""
+    years = np.asarray(years).astype(int)
+    breaks = np.flatnonzero(np.diff(years) > 1)
+    firsts = np.append(years[:1], years[breaks + 1])
+    lasts = np.append(years[breaks], years[-1:])
+    return [[int(first), int(last)] for first, last in zip(firsts, lasts)]
+
+
+def widen_measures(df):
+    """Return df with its float32 columns as float64, each value at the shortest decimal that reads back as
+    the same float32, so that a Value stored as 1234.57 is shown and exported as 1234.57 and not as
+    1234.5699462890625."""
+    measures = [col for col, dtype in df.dtypes.items() if dtype == np.float32]
+    if not measures:
+        return df
+    return df.assign(**{col: df[col].to_numpy().astype(str).astype(np.float64) for col in measures})
+
+
+class SliceIndex:
+    """Row index of the balances dataset by commodity, country and market year.
+
+    Commodity and country labels are mapped to the integer codes of their
+    categoricals, and every (commodity, country) pair is located as a
+    contiguous block of rows in Market_Year order. A dictionary maps each pair
+    to its block in O(1) and the year is located inside the block with a
+    binary search, so callbacks never scan or compare strings over the full
+    table. The rows are never copied: the ETL writes them sorted by commodity,
+    country and year, so the blocks are found in place; for rows in any other
+    order only the sorted row positions are kept, and each slice is taken
+    through them.
+    """
+
+    def __init__(self, data):
+        commodities = data['Commodity_Description'].astype('category')
+        countries = data['Country_Name'].astype('category')
+        self._commodity_codes = {label: code for code, label in enumerate(commodities.cat.categories)}
+        self._country_codes = {label: code for code, label in enumerate(countries.cat.categories)}
+        self._n_countries = len(self._country_codes)
+
+        keys = commodities.cat.codes.to_numpy(np.int64) * self._n_countries + countries.cat.codes.to_numpy(np.int64)
+        years = data['Market_Year'].to_numpy()
+        self.data = data
+
+        # Blocks of equal keys in the stored order; the rows are usable in place if no key is split
+        # over several blocks and the years ascend within each block
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        years_ascend = np.all((np.diff(years) >= 0) | (np.diff(keys) != 0))
+        if years_ascend and len(np.unique(keys[starts])) == len(starts):
+            self._order = None
+            self._years = years
+            block_keys = keys[starts]
+        else:
+            # lexsort is stable, which keeps the original row order within a market year
+            self._order = np.lexsort((years, keys))
+            self._years = years[self._order]
+            sorted_keys = keys[self._order]
+            starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            block_keys = sorted_keys[starts]
+        stops = np.append(starts[1:], len(keys))
+        # Blocks in key order, so pairs() lists them in the same order whatever the order of the rows
+        self._ranges = dict(sorted(zip(block_keys.tolist(), zip(starts.tolist(), stops.tolist()))))
+
+    def _key(self, commodity, country):
+        commodity_code = self._commodity_codes.get(commodity)
+        country_code = self._country_codes.get(country)
+        if commodity_code is None or country_code is None:
+            return None
+        return commodity_code * self._n_countries + country_code
+
+    def _range(self, commodity, country, year=None):
+        start, stop = self._ranges.get(self._key(commodity, country), (0, 0))
+        if year is not None and stop > start:
+            years = self._years[start:stop]
+            start, stop = (start + np.searchsorted(years, year, side='left'),
+                           start + np.searchsorted(years, year, side='right'))
+        return start, stop
+
+    def slice(self, commodity, country, year=None, attribute=None):
+        """Return a copy of the rows for a commodity and country, optionally for one year and attribute.
+
+        The slice is small, so its label columns are decoded to plain strings
+        and its float32 measures widened (see widen_measures); callbacks
+        relabel, pivot, display and export it like any other frame.
+        """
+        start, stop = self._range(commodity, country, year)
+        record_rows(stop - start)
+        sliced = self.data.iloc[start:stop] if self._order is None else self.data.take(self._order[start:stop])
+        if attribute is not None:
+            sliced = sliced[sliced['Attribute_Description'] == attribute]
+
+        categorical = [col for col, dtype in sliced.dtypes.items() if dtype.name == 'category']
+        return widen_measures(sliced.astype({col: object for col in categorical}))
+
+    def years(self, commodity, country):
+        """Return the market years available for a commodity and country, in ascending order."""
+        start, stop = self._range(commodity, country)
+        record_rows(stop - start)
+        return np.unique(self._years[start:stop])
+
+    def pairs(self, commodities=None, countries=None):
+        """Return the (commodity, country) pairs that have rows, optionally restricted to some labels, in index order."""
+        commodity_labels = {code: label for label, code in self._commodity_codes.items()}
+        country_labels = {code: label for label, code in self._country_codes.items()}
+        pairs = [(commodity_labels[key // self._n_countries], country_labels[key % self._n_countries])
+                 for key in self._ranges]
+        return [(commodity, country) for commodity, country in pairs
+                if (not commodities or commodity in commodities) and (not countries or country in countries)]
+
+    def year_runs(self):
+        """Return {(commodity, country): [[first year, last year], ...]}, the runs of consecutive market years of every pair."""
+        runs = {}
+        for commodity, country in self.pairs():
+            start, stop = self._range(commodity, country)
+            runs[(commodity, country)] = consecutive_runs(np.unique(self._years[start:stop]))
+        return runs
+
+    def query(self, country=None, attribute=None):
+        """Return the rows of a country and/or an attribute across all commodities, in the original order.
+
+        This is a scan of the full table, for the rare queries that are not by commodity and country.
+        """
+        mask = np.ones(len(self.data), dtype=bool)
+        if country is not None:
+            mask &= (self.data['Country_Name'] == country).to_numpy()
+        if attribute is not None:
+            mask &= (self.data['Attribute_Description'] == attribute).to_numpy()
+        record_rows(len(self.data))
+        return self.data[mask]
+
+    def unique(self, column):
+        """Return the distinct values of a column in order of appearance."""
+        return list(self.data[column].unique())
+
+    def empty(self):
+        """Return an empty frame with the columns and types of a slice."""
+        return self.slice(None, None)
+
+    def __len__(self):
+        return len(self.data)
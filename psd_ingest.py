@@ -0,0 +1,115 @@
+import contextlib
+import hashlib
+import json
+import os
+import zipfile
+import pandas as pd
+
+# Columns of the USDA PS&D bulk files used by the ETL (Calendar_Year and Month are never read)
+PSD_DTYPES = {
+    'Commodity_Code': 'int32',
+    'Commodity_Description': 'object',
+    'Country_Code': 'object',
+    'Country_Name': 'object',
+    'Market_Year': 'int16',
+    'Attribute_ID': 'int16',
+    'Attribute_Description': 'object',
+    'Unit_ID': 'int16',
+    'Unit_Description': 'object',
+    'Value': 'float64',
+}
+
+# Rows parsed per chunk; bounds the memory used by rows that are filtered out
+CHUNK_SIZE = 500_000
+
+# Suffix of the file recording the checksums of the sources an artifact was built from
+SOURCE_STATE_SUFFIX = '.source.json'
+
+
+def find_source(csv_path):
+    """Return (path, zip member) of a source CSV: the CSV itself if it was extracted, else the CSV member
+    of the zipped bulk download next to it (<name>_csv.zip as published by the USDA, or <name>.zip)."""
+    if os.path.exists(csv_path):
+        return csv_path, None
+    stem = os.path.splitext(csv_path)[0]
+    for zip_path in [stem + '_csv.zip', stem + '.zip']:
+        if os.path.exists(zip_path):
+            return zip_path, os.path.basename(csv_path)
+    raise FileNotFoundError(csv_path)
+
+
+def csv_member(archive, member=None):
+    """Return the name of a CSV member of a zip archive: the one named member, or the only one."""
+    names = [name for name in archive.namelist() if name.lower().endswith('.csv')]
+    if member is not None:
+        names = [name for name in names if os.path.basename(name) == member]
+    if len(names) != 1:
+        raise ValueError(f"expected one CSV member {member or ''} in {archive.filename}, found {names}")
+    return names[0]
+
+
+@contextlib.contextmanager
+def open_source(path, member=None):
+    """Open a source CSV for reading; a CSV member of a zip archive is decompressed as it is read."""
+    if not zipfile.is_zipfile(path):
+        with open(path, 'rb') as f:
+            yield f
+        return
+    with zipfile.ZipFile(path) as archive, archive.open(csv_member(archive, member)) as f:
+        yield f
+
+
+def source_checksum(path, member=None):
+    """Return a checksum of the content of a source CSV.
+
+    For a zip member this is the CRC-32 and size of the uncompressed member
+    recorded in the archive directory, so nothing is decompressed; a plain
+    CSV is hashed.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            info = archive.getinfo(csv_member(archive, member))
+        return f'crc32:{info.CRC:08x}-{info.file_size}'
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return f'sha1:{digest.hexdigest()}'
+
+
+def source_unchanged(base_path, fingerprint):
+    """Return whether the artifact at base_path was last built from sources with this fingerprint."""
+    try:
+        with open(base_path + SOURCE_STATE_SUFFIX) as f:
+            return json.load(f) == fingerprint
+    except (OSError, ValueError):
+        return False
+
+
+def record_source(base_path, fingerprint):
+    """Record the fingerprint of the sources of the artifact at base_path, once it is written."""
+    tmp_path = base_path + SOURCE_STATE_SUFFIX + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(fingerprint, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, base_path + SOURCE_STATE_SUFFIX)
+
+
+def read_psd(path, country_codes=None, chunksize=CHUNK_SIZE, member=None):
+    """Stream a PS&D CSV and keep only the rows of the given Country_Codes (all rows if None).
+
+    Only the columns in PSD_DTYPES are parsed, and rows of other countries are
+    dropped chunk by chunk, so peak memory is bounded by the size of the
+    filtered output plus one chunk instead of by the size of the source file.
+    path may also be a zip archive, whose CSV member (see csv_member) is
+    decompressed into the parser chunk by chunk without being extracted.
+    """
+    country_codes = None if country_codes is None else list(country_codes)
+    chunks = []
+    with open_source(path, member) as f:
+        reader = pd.read_csv(f, usecols=list(PSD_DTYPES), dtype=PSD_DTYPES, chunksize=chunksize)
+        for chunk in reader:
+            chunks.append(chunk if country_codes is None else chunk[chunk['Country_Code'].isin(country_codes)])
+
+    if not chunks:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in PSD_DTYPES.items()})
+    return pd.concat(chunks, ignore_index=True)
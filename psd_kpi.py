@@ -0,0 +1,92 @@
+import pandas as pd
+
+from psd_yield_stats import YieldStats
+
+# Keys of a KPI row
+KPI_KEYS = ['Country_Code', 'Country_Name', 'Commodity_Code', 'Commodity_Description', 'Market_Year']
+
+# Keys of a yield series
+SERIES_KEYS = ['Country_Code', 'Commodity_Code']
+
+# Balance attributes summed per key: Attribute_Description → KPI column
+BALANCE_ATTRIBUTES = {
+    'Production': 'Production',
+    'Imports': 'Imports',
+    'Beginning Stocks': 'Beginning_Stocks',
+    'Ending Stocks': 'Ending_Stocks',
+    'FSI Consumption': 'FSI_Consumption',
+}
+
+# Windows of the yield variability (coefficient of variation of the first differences)
+YIELD_CV_WINDOWS = [(1960, 1990), (1980, 2010), (2000, 2024)]
+
+# Yield growth (CAGR) periods: (start years, end years, number of years)
+YIELD_CAGR_PERIODS = [((1980, 1984), (2020, 2024), 40), ((2000, 2004), (2020, 2024), 20)]
+
+
+def yield_cv_column(start_year, end_year):
+    return f'Yield_CV_{start_year}_{end_year}'
+
+
+def yield_cagr_column(start_years, end_years):
+    return f'Yield_CAGR_{start_years[0]}_{end_years[0]}'
+
+
+def _series_index(df):
+    return pd.MultiIndex.from_arrays([df[key] for key in SERIES_KEYS])
+
+
+def build_kpi_table(df, reference_region='NN'):
+    """Compute the KPI panel of the dashboard for every (country, commodity, market year).
+
+    The KPIs follow the definitions of the dashboard: supply ratios and per
+    capita figures (kg/person/year) of each balance, the yield level relative
+    to reference_region (North Africa) and, per country and commodity, the
+    yield variability over YIELD_CV_WINDOWS and the yield growth over
+    YIELD_CAGR_PERIODS. Ratios with a zero denominator are 0, as in the
+    dashboard; KPIs that cannot be computed are NaN.
+    """
+    df = df[KPI_KEYS + ['Attribute_Description', 'Value', 'Population']]
+    df = df.astype({'Country_Code': str, 'Country_Name': str, 'Commodity_Description': str, 'Attribute_Description': str,
+                    'Value': 'float64', 'Population': 'float64'})
+
+    kpi = df.groupby(KPI_KEYS)[['Population']].first()
+
+    balance = df[df['Attribute_Description'].isin(list(BALANCE_ATTRIBUTES))]
+    sums = balance.groupby(KPI_KEYS + ['Attribute_Description'])['Value'].sum().unstack('Attribute_Description')
+    sums = sums.reindex(index=kpi.index, columns=list(BALANCE_ATTRIBUTES)).fillna(0).rename(columns=BALANCE_ATTRIBUTES)
+    kpi = kpi.join(sums)
+
+    kpi['Total_Supply'] = kpi['Production'] + kpi['Imports'] + kpi['Beginning_Stocks'] - kpi['Ending_Stocks']
+    has_supply = kpi['Total_Supply'] != 0
+    kpi['Self_Sufficiency_Ratio'] = (kpi['Production'] / kpi['Total_Supply']).where(has_supply, 0)
+    kpi['Import_Dependency_Ratio'] = (kpi['Imports'] / kpi['Total_Supply']).where(has_supply, 0)
+    kpi['Stocks_To_Use_Ratio'] = (kpi['Beginning_Stocks'] / kpi['Total_Supply']).where(has_supply, 0)
+
+    has_population = kpi['Population'] != 0
+    for column in ['Production', 'Imports', 'Total_Supply', 'FSI_Consumption']:
+        kpi[f'Per_Capita_{column}'] = (kpi[column] / kpi['Population'] * 1000).where(has_population, 0)
+
+    # Yield level of the selection relative to the reference region in the same commodity and year
+    yields = df[df['Attribute_Description'] == 'Yield']
+    kpi['Yield'] = yields.groupby(KPI_KEYS)['Value'].mean().reindex(kpi.index)
+    reference = yields[yields['Country_Code'] == reference_region].groupby(['Commodity_Code', 'Market_Year'])['Value'].mean()
+    reference = reference.reindex(pd.MultiIndex.from_arrays([kpi.index.get_level_values('Commodity_Code'),
+                                                             kpi.index.get_level_values('Market_Year')]))
+    reference = pd.Series(reference.to_numpy(), index=kpi.index)
+    kpi['Yield_Ratio_Reference'] = (kpi['Yield'] / reference * 100).where(reference != 0)
+
+    # Yield variability and growth are properties of a whole (country, commodity) series
+    kpi_series = _series_index(kpi.index.to_frame(index=False))
+    stats = YieldStats(yields, keys=SERIES_KEYS)
+    for start_year, end_year in YIELD_CV_WINDOWS:
+        cv = pd.Series(stats.cv(start_year, end_year), index=stats.index)
+        kpi[yield_cv_column(start_year, end_year)] = cv.reindex(kpi_series).to_numpy()
+
+    for start_years, end_years, _ in YIELD_CAGR_PERIODS:
+        # Growth over end_years[1] - start_years[1] years, the number of years of the period
+        length = start_years[1] - start_years[0] + 1
+        cagr = pd.Series(stats.cagr(start_years[0], end_years[1], length), index=stats.index)
+        kpi[yield_cagr_column(start_years, end_years)] = cagr.reindex(kpi_series, fill_value=0).to_numpy()
+
+    return kpi.reset_index()
@@ -0,0 +1,202 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+import flask
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROWS_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# Directory where each process of a multi-process server (gunicorn workers) stores its histograms,
+# so that /metrics reports the sums over all of them; unset, /metrics reports this process only
+METRICS_DIR = os.getenv('PSD_METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.getenv('PSD_METRICS_FLUSH_INTERVAL', 5))
+
+# Rows scanned by the callback running in the current context (None outside instrumented callbacks)
+_rows_scanned = contextvars.ContextVar('psd_rows_scanned', default=None)
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus layout: bucket counts, sum and count."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def exposition(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+    def merge(self, counts, total, count):
+        for i, n in enumerate(counts):
+            self.counts[i] += n
+        self.sum += total
+        self.count += count
+
+
+# metric name → (help text, buckets)
+METRICS = {
+    'psd_callback_duration_seconds': ('Wall time of the dashboard callbacks.', SECONDS_BUCKETS),
+    'psd_callback_rows_scanned': ('Dataset rows read by the dashboard callbacks.', ROWS_BUCKETS),
+    'psd_callback_response_bytes': ('Serialized response size of the dashboard callbacks.', BYTES_BUCKETS),
+}
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_histograms = {}  # (metric name, callback name) → Histogram
+_store = {'pid': None, 'path': None, 'dirty': False}
+
+
+def _store_path():
+    """Return the file of this process in METRICS_DIR, starting its periodic flush on first use.
+
+    The name is unique to the process, so that a worker started with the
+    pid of a dead one does not overwrite the histograms of the dead one.
+    """
+    if _store['pid'] != os.getpid():
+        # A forked worker starts with a copy of its parent's histograms, which the parent's file already counts
+        _histograms.clear()
+        _store.update(pid=os.getpid(), path=os.path.join(METRICS_DIR, f'{os.getpid()}-{uuid.uuid4().hex}.json'))
+        threading.Thread(target=_flush_periodically, name='psd-metrics-flush', daemon=True).start()
+    return _store['path']
+
+
+def flush():
+    """Write the histograms of this process to its file in METRICS_DIR, if they changed."""
+    with _flush_lock:
+        with _lock:
+            if METRICS_DIR is None or not _store['dirty'] or _store['pid'] != os.getpid():
+                return
+            records = [[metric, callback, list(h.counts), h.sum, h.count] for (metric, callback), h in _histograms.items()]
+            _store['dirty'] = False
+        # Replaced atomically so a scrape never reads a partial file
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        tmp_path = _store['path'] + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(records, f)
+        os.replace(tmp_path, _store['path'])
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def observe(metric, callback, value):
+    with _lock:
+        if METRICS_DIR is not None:
+            _store_path()
+            _store['dirty'] = True
+        histogram = _histograms.get((metric, callback))
+        if histogram is None:
+            histogram = _histograms[(metric, callback)] = Histogram(METRICS[metric][1])
+        histogram.observe(value)
+
+
+def _collect():
+    """Return the histograms of every process sharing METRICS_DIR summed, or those of this process."""
+    if METRICS_DIR is None:
+        with _lock:
+            return dict(_histograms)
+    flush()
+    histograms = {}
+    for name in os.listdir(METRICS_DIR) if os.path.isdir(METRICS_DIR) else []:
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric, callback, counts, total, count in records:
+            if metric in METRICS:
+                histogram = histograms.get((metric, callback))
+                if histogram is None:
+                    histogram = histograms[(metric, callback)] = Histogram(METRICS[metric][1])
+                histogram.merge(counts, total, count)
+    return histograms
+
+
+def record_rows(n):
+    """Count n rows as scanned by the instrumented callback currently running, if any."""
+    rows = _rows_scanned.get()
+    if rows is not None:
+        rows[0] += n
+
+
+def instrument(callback):
+    """Record the wall time and rows scanned of a Dash callback.
+
+    Its response size is recorded by the after_request hook installed by
+    register_metrics_endpoint, from the response Dash has already serialized.
+    """
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        rows = [0]
+        token = _rows_scanned.set(rows)
+        start = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            observe('psd_callback_duration_seconds', callback.__name__, time.perf_counter() - start)
+            observe('psd_callback_rows_scanned', callback.__name__, rows[0])
+            _rows_scanned.reset(token)
+            if flask.has_request_context():
+                flask.g.psd_callback = callback.__name__
+
+    return wrapper
+
+
+def exposition():
+    """Return all histograms in the Prometheus text exposition format."""
+    histograms = _collect()
+    lines = []
+    for metric, (help_text, _) in METRICS.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        for (name, callback), histogram in sorted(histograms.items()):
+            if name == metric:
+                lines.extend(histogram.exposition(metric, f'callback="{callback}"'))
+    return '\n'.join(lines) + '\n'
+
+
+def register_metrics_endpoint(server, path='/metrics'):
+    """Serve the callback metrics at path on the Flask server and record response sizes."""
+    @server.after_request
+    def record_response_size(response):
+        callback = flask.g.pop('psd_callback', None)
+        if callback is not None:
+            observe('psd_callback_response_bytes', callback, response.calculate_content_length() or 0)
+        return response
+
+    @server.route(path)
+    def metrics():
+        return flask.Response(exposition(), mimetype='text/plain; version=0.0.4')
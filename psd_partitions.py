@@ -0,0 +1,121 @@
+import collections
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+from psd_index import SliceIndex
+from psd_metrics import record_rows
+from psd_store import load_dataset, partitions_path, partitions_version
+
+# Rows of the partitions kept loaded per process; the least recently used are dropped beyond it
+PARTITION_CACHE_ROWS = int(os.getenv('PSD_PARTITION_CACHE_ROWS', 2_000_000))
+
+
+class PartitionedIndex:
+    """Queries of the dashboard against a dataset partitioned by commodity, with the interface of SliceIndex.
+
+    The index is bound to the version of the dataset published when it was
+    created (see write_partitions). Availability (pairs, years, labels) is
+    answered from the manifest; a commodity's partition is loaded and indexed
+    on first access and kept in an LRU bounded by PARTITION_CACHE_ROWS rows.
+    """
+
+    def __init__(self, base_path, cache_rows=PARTITION_CACHE_ROWS):
+        self.version = partitions_version(base_path)
+        if self.version is None:
+            raise FileNotFoundError(partitions_path(base_path))
+        self.directory = os.path.join(partitions_path(base_path), self.version)
+        with open(os.path.join(self.directory, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.cache_rows = cache_rows
+        self._partitions = collections.OrderedDict()  # commodity → SliceIndex
+        self._projections = {}  # attribute → rows of every commodity
+        self._lock = threading.Lock()
+
+    def _partition(self, commodity):
+        with self._lock:
+            if commodity in self._partitions:
+                self._partitions.move_to_end(commodity)
+                return self._partitions[commodity]
+        partition = self.manifest['partitions'].get(commodity)
+        if partition is None:
+            return None
+
+        index = SliceIndex(load_dataset(os.path.join(self.directory, partition['file'])))
+        with self._lock:
+            self._partitions[commodity] = index
+            rows = sum(len(loaded) for loaded in self._partitions.values())
+            while rows > self.cache_rows and len(self._partitions) > 1:
+                _, evicted = self._partitions.popitem(last=False)
+                rows -= len(evicted)
+        return index
+
+    def slice(self, commodity, country, year=None, attribute=None):
+        """Return the rows for a commodity and country, optionally for one year and attribute."""
+        index = self._partition(commodity)
+        if index is None:
+            return self.empty()
+        return index.slice(commodity, country, year, attribute)
+
+    def _projection(self, attribute):
+        with self._lock:
+            if attribute in self._projections:
+                return self._projections[attribute]
+        rows = load_dataset(os.path.join(self.directory, self.manifest['projections'][attribute]['file']))
+        with self._lock:
+            self._projections[attribute] = rows
+        return rows
+
+    def query(self, country=None, attribute=None):
+        """Return the rows of a country and/or an attribute across all commodities.
+
+        The attributes projected at build time (see write_partitions) are read
+        from their projection, once per version of the dataset. Other queries
+        read every partition once, without entering the cache, so a full scan
+        does not evict the partitions in use.
+        """
+        if attribute in self.manifest.get('projections', {}):
+            rows = self._projection(attribute)
+            record_rows(len(rows))
+            return rows if country is None else rows[rows['Country_Name'] == country]
+
+        frames = []
+        for partition in self.manifest['partitions'].values():
+            index = SliceIndex(load_dataset(os.path.join(self.directory, partition['file'])))
+            frames.append(index.query(country, attribute))
+        if not frames:
+            return self.empty()
+        # The partitions have their own categories; concat falls back to plain labels where they differ
+        return pd.concat(frames, ignore_index=True)
+
+    def years(self, commodity, country):
+        """Return the market years available for a commodity and country, in ascending order."""
+        runs = self.manifest['runs'].get(commodity, {}).get(country, [])
+        return np.array([year for first, last in runs for year in range(first, last + 1)], dtype=int)
+
+    def pairs(self, commodities=None, countries=None):
+        """Return the (commodity, country) pairs that have rows, optionally restricted to some labels."""
+        return [(commodity, country) for commodity in sorted(self.manifest['runs'])
+                for country in sorted(self.manifest['runs'][commodity])
+                if (not commodities or commodity in commodities) and (not countries or country in countries)]
+
+    def year_runs(self):
+        """Return {(commodity, country): [[first year, last year], ...]}, the runs of consecutive market years of every pair."""
+        return {(commodity, country): runs for commodity, countries in self.manifest['runs'].items()
+                for country, runs in countries.items()}
+
+    def unique(self, column):
+        """Return the distinct commodities or countries in order of appearance."""
+        return list(self.manifest['labels'][column])
+
+    def empty(self):
+        """Return an empty frame with the columns and types of a slice."""
+        commodity = next(iter(self.manifest['partitions']), None)
+        if commodity is None:
+            return pd.DataFrame()
+        return self._partition(commodity).empty()
+
+    def __len__(self):
+        return self.manifest['rows']
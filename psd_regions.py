@@ -0,0 +1,174 @@
+"""Batch build of the balances of several regional dashboards from one parse of the PS&D source.
+
+    python psd_regions.py [--config psd_regions.json] [--workers N] [--force] [region ...]
+
+Each region of the config file names its output artifact, the PS&D country
+codes it reads, its regional aggregates (code → [name, member codes]), the
+countries and aggregates it publishes and the aggregate its KPIs compare yields
+to (kpi_reference). The source is parsed once for the
+countries of all the regions, and the country cleaning, commodity aggregates,
+deduplication and yields are computed once for all of them. Each region then
+adds its own aggregates and population and writes its artifact and KPIs in a
+worker process. As with the ETL scripts, a region whose sources and
+definition did not change since its last build is skipped (see
+source_checksum).
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import pandas as pd
+
+from psd_etl import (COUNTRY_CODE_REPLACEMENTS, add_derived_attributes, add_population,
+                     aggregate_commodities, aggregate_regions, clean_countries, finalize, population_dimension,
+                     region_rows)
+from psd_forecast import update_forecasts
+from psd_incremental import config_fingerprint
+from psd_ingest import find_source, open_source, read_psd, record_source, source_checksum, source_unchanged
+from psd_kpi import build_kpi_table
+from psd_store import data_version, load_dataset, write_artifacts
+
+BasePath = os.path.dirname(os.path.abspath(__file__))
+
+# Region definitions read by default
+REGIONS_FILE = os.path.join(BasePath, 'psd_regions.json')
+
+# Rows shared by the region builds, inherited by the forked workers (see build_regions)
+_shared = {}
+
+
+def load_regions(path=REGIONS_FILE):
+    """Read a region config file: {'replacements': {...}, 'regions': {name: definition}}."""
+    with open(path) as f:
+        config = json.load(f)
+    regions = {}
+    for name, region in config['regions'].items():
+        regions[name] = dict(region, aggregates={code: (region_name, list(members))
+                                                 for code, (region_name, members) in region.get('aggregates', {}).items()})
+    return config.get('replacements', COUNTRY_CODE_REPLACEMENTS), regions
+
+
+def shared_balances(subset_df, replacements=COUNTRY_CODE_REPLACEMENTS):
+    """Run the stages of the balances that do not depend on the region on the rows of every country.
+
+    Returns the rows after the cleaning and commodity aggregates, from which
+    the regional aggregates are summed, and the country balances: those rows
+    deduplicated with their derived attributes (yields).
+    """
+    df = aggregate_commodities(clean_countries(subset_df, replacements))
+    return df, add_derived_attributes(aggregate_regions(df, regions={}))
+
+
+def region_balances(shared, population_df, region, replacements=COUNTRY_CODE_REPLACEMENTS):
+    """Build the balances of one region from the output of shared_balances.
+
+    Gives the same rows as build_balances run on the region's countries: the
+    regional aggregates are summed from the country rows before deduplication,
+    as in aggregate_regions, and their yields computed from those sums.
+    """
+    commodity_df, balances_df = shared
+    codes = {replacements.get(code, code) for code in region['countries']}
+    df = balances_df[balances_df['Country_Code'].isin(codes)]
+
+    aggregates = region_rows(commodity_df[commodity_df['Country_Code'].isin(codes)], region['aggregates'])
+    if aggregates:
+        aggregates_df = aggregate_regions(pd.concat(aggregates, ignore_index=True), regions={})
+        df = pd.concat([df, add_derived_attributes(aggregates_df)], ignore_index=True)
+
+    df = add_population(df, population_dimension(population_df, regions=region['aggregates']))
+    return finalize(df, region.get('published'))
+
+
+def build_region(name):
+    """Build and write the artifact and KPIs of one region; runs in a pool worker."""
+    region = _shared['regions'][name]
+    merged_df = region_balances(_shared['balances'], _shared['population'], region, _shared['replacements'])
+
+    output_path = os.path.join(BasePath, region['output'])
+    written = write_artifacts(merged_df, output_path, write_csv=_shared['write_csv'], write_db=_shared['write_db'])
+    written += write_artifacts(build_kpi_table(merged_df, region.get('kpi_reference', 'NN')), output_path + '_kpi')
+    return name, written
+
+
+def build_regions(subset_df, population_df, regions, replacements=COUNTRY_CODE_REPLACEMENTS, workers=None,
+                  write_csv=True, write_db=False):
+    """Build the regions from the PS&D rows of all their countries; return {region: written files}.
+
+    The shared stages run once in this process, and the regions are built
+    in parallel by forked workers, which inherit the shared rows instead of
+    receiving a copy each.
+    """
+    _shared.update(balances=shared_balances(subset_df, replacements), population=population_df, regions=regions,
+                   replacements=replacements, write_csv=write_csv, write_db=write_db)
+    try:
+        if len(regions) == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            return dict(build_region(name) for name in regions)
+        context = multiprocessing.get_context('fork')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(regions)),
+                                                    mp_context=context) as pool:
+            return dict(pool.map(build_region, regions))
+    finally:
+        _shared.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the balances of several regions from one parse of the PS&D file.')
+    parser.add_argument('regions', nargs='*', help='regions of the config file to build (default: all)')
+    parser.add_argument('--config', default=REGIONS_FILE, help='region config file')
+    parser.add_argument('--source', default=os.path.join(BasePath, '..', 'data', 'psd_alldata.csv'))
+    parser.add_argument('--population', default=os.path.join(BasePath, '..', 'data', 'Population.csv'))
+    parser.add_argument('--workers', type=int, default=None, help='region build processes (default: all cores)')
+    parser.add_argument('--force', action='store_true', default=os.getenv('PSD_FORCE', '0') == '1',
+                        help='rebuild the regions even if their sources did not change since their last build')
+    args = parser.parse_args()
+
+    replacements, regions = load_regions(args.config)
+    unknown = set(args.regions) - set(regions)
+    if unknown:
+        parser.error(f"unknown regions: {', '.join(sorted(unknown))}")
+    if args.regions:
+        regions = {name: regions[name] for name in args.regions}
+
+    write_csv = os.getenv('PSD_WRITE_CSV', '1') != '0'
+    write_db = os.getenv('PSD_WRITE_SQLITE', '0') == '1'
+    write_forecast = os.getenv('PSD_FORECAST', '0') == '1'
+
+    # Skip the regions last built from the same sources, with the same definition and options
+    psd_source = find_source(args.source)
+    population_source = find_source(args.population)
+    checksums = {'psd': source_checksum(*psd_source), 'population': source_checksum(*population_source)}
+    fingerprints = {}
+    for name, region in regions.items():
+        fingerprints[name] = dict(checksums, build=f'region:{name}', config=config_fingerprint(),
+                                  options=[write_csv, write_db, write_forecast],
+                                  region=json.dumps([region, replacements], sort_keys=True))
+    output_paths = {name: os.path.join(BasePath, region['output']) for name, region in regions.items()}
+    stale = [name for name in regions if args.force or data_version(output_paths[name]) is None
+             or not source_unchanged(output_paths[name], fingerprints[name])]
+    for name in regions:
+        if name not in stale:
+            print(f"Region {name}: sources unchanged since the last build, skipped")
+    if not stale:
+        return
+
+    # Parse the source once for the countries of all the regions to build
+    country_codes = sorted({code for name in stale for code in regions[name]['countries']})
+    subset_df = read_psd(psd_source[0], country_codes, member=psd_source[1])
+    with open_source(*population_source) as f:
+        population_df = pd.read_csv(f)
+
+    built = build_regions(subset_df, population_df, {name: regions[name] for name in stale}, replacements,
+                          args.workers, write_csv, write_db)
+    for name, written in built.items():
+        for written_path in written:
+            print(f"Output file created: {written_path}")
+        # The forecasts fit their series in a process pool of their own, so they run after the region builds
+        if write_forecast:
+            for written_path in update_forecasts(load_dataset(output_paths[name]), output_paths[name]):
+                print(f"Output file created: {written_path}")
+        record_source(output_paths[name], fingerprints[name])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import collections
+import os
+import threading
+import time
+import flask
+import pandas as pd
+
+from psd_index import SliceIndex
+from psd_forecast import forecast_path, forecast_table
+from psd_kpi import build_kpi_table
+from psd_partitions import PartitionedIndex
+from psd_sqlite import SqliteIndex
+from psd_store import data_version, file_version, load_dataset, partitions_version, sqlite_path
+from psd_yield_stats import YieldStats
+
+# Seconds between two checks of the published artifacts
+RELOAD_INTERVAL = float(os.getenv('PSD_RELOAD_INTERVAL', 30))
+
+# Storage backend of the balances: 'memory' loads the Arrow (or CSV) artifact in every process,
+# 'sqlite' queries the indexed .sqlite database written with PSD_WRITE_SQLITE=1 and 'partitioned'
+# loads the per-commodity partitions of the global build (.partitions) on demand
+BACKEND = os.getenv('PSD_BACKEND', 'memory')
+
+# Commodities whose yield statistics are kept by a snapshot (see Snapshot.yield_stats)
+YIELD_STATS_CACHE = int(os.getenv('PSD_YIELD_STATS_CACHE', 16))
+
+
+def artifact_versions(data_path, kpi_path, backend=BACKEND):
+    """Return the versions of the balances artifact read by a backend, of the KPI and of the forecast artifacts."""
+    if backend == 'sqlite':
+        data = file_version(sqlite_path(data_path))
+    elif backend == 'partitioned':
+        data = partitions_version(data_path)
+    else:
+        data = data_version(data_path)
+    return data, data_version(kpi_path), data_version(forecast_path(data_path))
+
+
+class Snapshot:
+    """The dataset of the dashboard and everything derived from it, for one version of the artifacts.
+
+    A snapshot is never modified once built: callbacks take the current
+    snapshot once and read only from it, so a reload cannot change the data
+    under a callback that is running. Its memory grows with the rows read,
+    not with the dataset: the KPIs are located through a positional index
+    on their (memory-mapped) frame and the yield statistics are built per
+    commodity on first use.
+    """
+
+    def __init__(self, data_path, kpi_path, backend=BACKEND):
+        # Versions are taken before loading, so a rewrite during the load is picked up by the next check
+        self.versions = artifact_versions(data_path, kpi_path, backend)
+        self.version = self.versions[0]
+        if backend == 'sqlite':
+            self.data_index = SqliteIndex(sqlite_path(data_path))
+        elif backend == 'partitioned':
+            self.data_index = PartitionedIndex(data_path)
+        else:
+            self.data_index = SliceIndex(load_dataset(data_path))
+
+        # KPIs precomputed by the ETL (computed here if that artifact is missing)
+        self.kpis = load_dataset(kpi_path) if self.versions[1] is not None else build_kpi_table(self.data_index.query())
+        self.kpi_index = SliceIndex(self.kpis)
+
+        self._yield_stats = collections.OrderedDict()  # commodity → YieldStats, least recently used first
+        self._lock = threading.Lock()
+
+        # Forecasts of the time-series chart, fitted offline by psd_forecast (none if that artifact is missing)
+        self.forecasts = forecast_table(load_dataset(forecast_path(data_path))) if self.versions[2] is not None else {}
+
+    def yield_stats(self, commodity):
+        """Return the YieldStats of every country of a commodity, built from its rows on first use.
+
+        Only the YIELD_STATS_CACHE most recently used commodities are kept, so
+        that with the partitioned backend the statistics follow the partitions
+        read instead of spanning the whole dataset.
+        """
+        with self._lock:
+            if commodity in self._yield_stats:
+                self._yield_stats.move_to_end(commodity)
+                return self._yield_stats[commodity]
+        slices = [self.data_index.slice(commodity, country, attribute='Yield')
+                  for _, country in self.data_index.pairs([commodity])]
+        stats = YieldStats(pd.concat(slices, ignore_index=True) if slices else self.data_index.empty())
+        with self._lock:
+            self._yield_stats[commodity] = stats
+            while len(self._yield_stats) > YIELD_STATS_CACHE:
+                self._yield_stats.popitem(last=False)
+        return stats
+
+
+class SnapshotReloader:
+    """Holds the current snapshot and replaces it when the ETL publishes new artifacts.
+
+    A background thread checks the artifact versions every `interval`
+    seconds. A change is loaded once the versions have been stable for one
+    interval (the ETL writes the balances and the KPIs one after the other),
+    and the new snapshot is built entirely off the request path before it
+    replaces the current one with a single reference assignment.
+    """
+
+    def __init__(self, data_path, kpi_path, interval=RELOAD_INTERVAL, backend=BACKEND):
+        self.data_path = data_path
+        self.kpi_path = kpi_path
+        self.interval = interval
+        self.backend = backend
+        self.current = Snapshot(data_path, kpi_path, backend)
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def check(self, pending=None):
+        """Reload if the artifacts changed and were already seen changed at the previous check; return the versions seen."""
+        versions = artifact_versions(self.data_path, self.kpi_path, self.backend)
+        if versions == self.current.versions or versions[0] is None:
+            return None
+        if versions == pending:
+            snapshot = Snapshot(self.data_path, self.kpi_path, self.backend)
+            if snapshot.versions == versions:
+                self.current = snapshot
+                print(f"Reloaded the dataset, version {snapshot.version}")
+                return None
+        return versions
+
+    def _watch(self):
+        pending = None
+        while True:
+            time.sleep(self.interval)
+            try:
+                pending = self.check(pending)
+            except Exception as e:  # keep serving the current snapshot
+                print(f"Dataset reload failed: {e}")
+                pending = None
+
+    def start(self):
+        """Start the watcher of this process; threads do not survive a fork, so each worker starts its own."""
+        with self._lock:
+            if self._pid == os.getpid() or self.interval <= 0:
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._watch, name='psd-reloader', daemon=True).start()
+
+    def register(self, server, header='X-PSD-Data-Version'):
+        """Start the watcher with the first request of each worker, send the data version with every response
+        and serve the data version at /data-version and the readiness probe at /ready."""
+        @server.before_request
+        def start_reloader():
+            self.start()
+
+        @server.after_request
+        def add_data_version(response):
+            if self.current.version is not None:
+                response.headers[header] = self.current.version
+            return response
+
+        @server.route('/data-version')
+        def current_data_version():
+            return flask.jsonify(version=self.current.version)
+
+        @server.route('/ready')
+        def ready():
+            # Ready once a non-empty snapshot is loaded; with a preloaded app that is before any worker forks
+            snapshot = self.current
+            rows = len(snapshot.data_index) if snapshot is not None else 0
+            if rows == 0:
+                return flask.jsonify(ready=False), 503
+            return flask.jsonify(ready=True, version=snapshot.version, rows=rows)
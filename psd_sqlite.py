@@ -0,0 +1,141 @@
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+from psd_index import consecutive_runs
+from psd_metrics import record_rows
+from psd_store import ARTIFACT_DTYPES, SQLITE_TABLE
+
+# Read-only connections kept open per process
+POOL_SIZE = int(os.getenv('PSD_SQLITE_POOL_SIZE', 8))
+
+# Page cache of each connection (KiB) and the size of the file mapped into memory (bytes)
+CACHE_KIB = int(os.getenv('PSD_SQLITE_CACHE_KIB', 16 * 1024))
+MMAP_BYTES = int(os.getenv('PSD_SQLITE_MMAP_BYTES', 256 * 1024 * 1024))
+
+# Types of the query results: those of a SliceIndex slice (labels as plain strings, measures as the float64
+# values written by the ETL)
+QUERY_DTYPES = {col: {'category': object, 'float32': 'float64'}.get(dtype, dtype) for col, dtype in ARTIFACT_DTYPES.items()}
+
+
+class SqliteIndex:
+    """Queries of the dashboard against the SQLite database of the balances, with the interface of SliceIndex.
+
+    Only the rows a callback asks for are read, through the indexes written by
+    the ETL (see write_sqlite), so a worker keeps no copy of the dataset. The
+    read-only connections are pooled per process; a forked worker opens its
+    own instead of reusing those of its parent.
+    """
+
+    def __init__(self, path, pool_size=POOL_SIZE):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+        connection.execute('PRAGMA query_only = ON')
+        connection.execute(f'PRAGMA cache_size = -{CACHE_KIB}')
+        connection.execute(f'PRAGMA mmap_size = {MMAP_BYTES}')
+        return connection
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a read-only connection from the pool of this process."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = queue.LifoQueue()
+                self._pid = os.getpid()
+            pool = self._pool
+        try:
+            connection = pool.get_nowait()
+        except queue.Empty:
+            connection = self._connect()
+        try:
+            yield connection
+        finally:
+            if pool is self._pool and pool.qsize() < self.pool_size:
+                pool.put(connection)
+            else:
+                connection.close()
+
+    def _rows(self, where, params, order='Market_Year, rowid'):
+        sql = f'SELECT * FROM {SQLITE_TABLE}'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        with self.connection() as connection:
+            rows = pd.read_sql_query(f'{sql} ORDER BY {order}', connection, params=params)
+        record_rows(len(rows))
+        dtypes = {col: dtype for col, dtype in QUERY_DTYPES.items() if col in rows.columns}
+        return rows.astype(dtypes)
+
+    def _values(self, sql, params=()):
+        with self.connection() as connection:
+            return connection.execute(sql, params).fetchall()
+
+    def slice(self, commodity, country, year=None, attribute=None):
+        """Return the rows for a commodity and country, optionally for one year and attribute."""
+        where, params = ['Commodity_Description = ?', 'Country_Name = ?'], [commodity, country]
+        if year is not None:
+            where.append('Market_Year = ?')
+            params.append(int(year))
+        if attribute is not None:
+            where.append('Attribute_Description = ?')
+            params.append(attribute)
+        return self._rows(where, params)
+
+    def query(self, country=None, attribute=None):
+        """Return the rows of a country and/or an attribute across all commodities."""
+        where, params = [], []
+        if country is not None:
+            where.append('Country_Name = ?')
+            params.append(country)
+        if attribute is not None:
+            where.append('Attribute_Description = ?')
+            params.append(attribute)
+        return self._rows(where, params, order='rowid')
+
+    def years(self, commodity, country):
+        """Return the market years available for a commodity and country, in ascending order."""
+        rows = self._values(f'SELECT DISTINCT Market_Year FROM {SQLITE_TABLE} '
+                            'WHERE Commodity_Description = ? AND Country_Name = ? ORDER BY Market_Year',
+                            (commodity, country))
+        record_rows(len(rows))
+        return np.array([year for (year,) in rows], dtype=int)
+
+    def pairs(self, commodities=None, countries=None):
+        """Return the (commodity, country) pairs that have rows, optionally restricted to some labels."""
+        rows = self._values(f'SELECT DISTINCT Commodity_Description, Country_Name FROM {SQLITE_TABLE} '
+                            'ORDER BY Commodity_Description, Country_Name')
+        return [(commodity, country) for commodity, country in rows
+                if (not commodities or commodity in commodities) and (not countries or country in countries)]
+
+    def year_runs(self):
+        """Return {(commodity, country): [[first year, last year], ...]}, the runs of consecutive market years of every pair."""
+        rows = self._values(f'SELECT DISTINCT Commodity_Description, Country_Name, Market_Year FROM {SQLITE_TABLE} '
+                            'ORDER BY Commodity_Description, Country_Name, Market_Year')
+        years = {}
+        for commodity, country, year in rows:
+            years.setdefault((commodity, country), []).append(year)
+        return {pair: consecutive_runs(pair_years) for pair, pair_years in years.items()}
+
+    def unique(self, column):
+        """Return the distinct values of a column in order of appearance."""
+        if column not in QUERY_DTYPES:
+            raise KeyError(column)
+        return [value for (value,) in self._values(f'SELECT {column} FROM {SQLITE_TABLE} GROUP BY {column} ORDER BY MIN(rowid)')]
+
+    def empty(self):
+        """Return an empty frame with the columns and types of a slice."""
+        return self._rows(['0'], [])
+
+    def __len__(self):
+        return self._values(f'SELECT COUNT(*) FROM {SQLITE_TABLE}')[0][0]
@@ -0,0 +1,223 @@
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+import pandas as pd
+
+from psd_index import consecutive_runs
+
+# pyarrow is optional: without it the ETL only writes the CSV export and the
+# dashboard falls back to parsing that CSV.
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+# Column types of the published balances artifact: labels are dictionary-encoded
+# categoricals and measures are float32, which keeps the resident dataset compact
+ARTIFACT_DTYPES = {
+    'Country_Code': 'category',
+    'Country_Name': 'category',
+    'Commodity_Code': 'int32',
+    'Commodity_Description': 'category',
+    'Market_Year': 'int16',
+    'Attribute_Description': 'category',
+    'Value': 'float32',
+    'Population': 'float32',
+    'Attribute_ID': 'int16',
+    'Unit_ID': 'int16',
+    'Unit_Description': 'category',
+}
+
+
+# Table and indexes of the optional SQLite database of the balances: index name → columns
+SQLITE_TABLE = 'balances'
+SQLITE_INDEXES = {
+    'balances_codes': ['Commodity_Code', 'Country_Code', 'Market_Year', 'Attribute_ID'],
+    'balances_labels': ['Commodity_Description', 'Country_Name', 'Market_Year'],
+}
+
+
+def sqlite_path(base_path):
+    return base_path + '.sqlite'
+
+
+# Published versions of a partitioned dataset kept on disk (readers may still map the previous one)
+PARTITION_VERSIONS_KEPT = 2
+
+
+# Attributes the dashboard queries across all commodities (population line, yield statistics); a partitioned
+# dataset also stores their rows as projections, so those queries do not read every partition
+PROJECTED_ATTRIBUTES = ['Total Population', 'Yield']
+
+
+def partitions_path(base_path):
+    return base_path + '.partitions'
+
+
+def artifact_paths(base_path):
+    """Return the (arrow, csv) file names for an artifact base path without extension."""
+    return base_path + '.arrow', base_path + '.csv'
+
+
+def to_artifact_types(df):
+    """Cast the ETL output to the typed schema of the artifact."""
+    dtypes = {col: dtype for col, dtype in ARTIFACT_DTYPES.items() if col in df.columns}
+    return df.astype(dtypes)
+
+
+def write_sqlite(df, base_path):
+    """Write the balances to an indexed SQLite database that the dashboard can query instead of loading.
+
+    The rows keep their order (rowid) and the database is published atomically.
+    Returns the path of the database.
+    """
+    path = sqlite_path(base_path)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    connection = sqlite3.connect(tmp_path)
+    try:
+        df.to_sql(SQLITE_TABLE, connection, index=False, chunksize=100_000)
+        for name, columns in SQLITE_INDEXES.items():
+            connection.execute(f'CREATE INDEX {name} ON {SQLITE_TABLE} ({", ".join(columns)})')
+        connection.execute('ANALYZE')
+        connection.commit()
+    finally:
+        connection.close()
+
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_artifacts(df, base_path, write_csv=True, write_db=False):
+    """Write the balances as an Arrow IPC (Feather v2) file and optionally as CSV and as a SQLite database.
+
+    The Arrow file is written uncompressed so that readers can memory-map it
+    instead of parsing it. Returns the list of written files.
+    """
+    arrow_path, csv_path = artifact_paths(base_path)
+    written = []
+
+    if pa is not None:
+        table = pa.Table.from_pandas(to_artifact_types(df), preserve_index=False)
+        tmp_path = arrow_path + '.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        # Publish atomically so a running dashboard never sees a partial file
+        os.replace(tmp_path, arrow_path)
+        written.append(arrow_path)
+    elif not write_csv:
+        print("pyarrow is not installed, falling back to the CSV export")
+        write_csv = True
+
+    if write_csv:
+        df.to_csv(csv_path, index=False)
+        written.append(csv_path)
+
+    if write_db:
+        written.append(write_sqlite(df, base_path))
+
+    return written
+
+
+def write_partitions(df, base_path, key='Commodity_Code'):
+    """Write the balances as one artifact per commodity, for datasets too large to load as a whole.
+
+    Each version is written to its own directory under base_path.partitions
+    with a manifest.json of the partitions (file and rows per commodity), the
+    projections of PROJECTED_ATTRIBUTES (file and rows per attribute), the
+    labels in order of appearance and the market years of every (commodity,
+    country) as runs of consecutive years, so readers can list what is
+    available without opening any partition. The version is published by
+    atomically rewriting the CURRENT pointer file. Returns the version directory.
+    """
+    root = partitions_path(base_path)
+    version = f'{time.time_ns():x}'
+    directory = os.path.join(root, version)
+    os.makedirs(directory)
+
+    partitions = {}
+    runs = {}
+    for code, partition_df in df.groupby(key, sort=True):
+        name = f'commodity_{code}'
+        write_artifacts(partition_df, os.path.join(directory, name), write_csv=False)
+        description = str(partition_df['Commodity_Description'].iloc[0])
+        partitions[description] = {'file': name, 'rows': len(partition_df)}
+        years = partition_df.groupby('Country_Name', observed=True)['Market_Year'].unique()
+        runs[description] = {str(country): consecutive_runs(sorted(country_years)) for country, country_years in years.items()}
+
+    projections = {}
+    for attribute in PROJECTED_ATTRIBUTES:
+        name = 'attribute_' + re.sub(r'\W+', '_', attribute).lower()
+        projection_df = df[df['Attribute_Description'] == attribute]
+        write_artifacts(projection_df, os.path.join(directory, name), write_csv=False)
+        projections[attribute] = {'file': name, 'rows': len(projection_df)}
+
+    manifest = {
+        'partitions': partitions,
+        'projections': projections,
+        'runs': runs,
+        'labels': {col: [str(label) for label in df[col].unique()] for col in ['Commodity_Description', 'Country_Name']},
+        'rows': len(df),
+    }
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    pointer = os.path.join(root, 'CURRENT')
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(version)
+    os.replace(pointer + '.tmp', pointer)
+
+    versions = sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+    for old_version in versions[:-PARTITION_VERSIONS_KEPT]:
+        shutil.rmtree(os.path.join(root, old_version), ignore_errors=True)
+    return directory
+
+
+def partitions_version(base_path):
+    """Return the published version of a partitioned dataset, or None if there is none."""
+    try:
+        with open(os.path.join(partitions_path(base_path), 'CURRENT')) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def file_version(path):
+    """Return a token of a file's size and modification time, or None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+
+def data_version(base_path):
+    """Return a token identifying the published artifact, which changes whenever the ETL rewrites it."""
+    for path in artifact_paths(base_path):
+        if os.path.exists(path):
+            return file_version(path)
+    return None
+
+
+def load_dataset(base_path):
+    """Load the balances artifact, preferring the memory-mapped Arrow file.
+
+    Numeric columns of the Arrow file are handed to pandas without copying, so
+    their pages live in the OS page cache and are shared by every worker that
+    maps the same file. Label columns come back as categoricals. Falls back to
+    parsing the CSV export into the same compact types.
+    """
+    arrow_path, csv_path = artifact_paths(base_path)
+
+    if pa is not None and os.path.exists(arrow_path):
+        source = pa.memory_map(arrow_path, 'r')
+        table = pa.ipc.open_file(source).read_all()
+        return table.to_pandas(split_blocks=True)
+
+    return pd.read_csv(csv_path, dtype=ARTIFACT_DTYPES)
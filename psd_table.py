@@ -0,0 +1,74 @@
+import math
+import pandas as pd
+
+# Rows per page of the data table
+PAGE_SIZE = 25
+
+# Operators of the DataTable filter syntax, longest first so that '>=' is not read as '>'
+FILTER_OPERATORS = [
+    ('s>=', 'ge'), ('s<=', 'le'), ('s!=', 'ne'), ('s=', 'eq'), ('s>', 'gt'), ('s<', 'lt'),
+    ('>=', 'ge'), ('<=', 'le'), ('!=', 'ne'), ('=', 'eq'), ('>', 'gt'), ('<', 'lt'),
+    ('contains ', 'contains'), ('datestartswith ', 'datestartswith'),
+]
+
+
+def table_columns(df):
+    """Column definitions of a DataTable showing df; numeric columns filter and sort as numbers."""
+    return [{'name': col, 'id': col, 'type': 'numeric' if pd.api.types.is_numeric_dtype(dtype) else 'text'}
+            for col, dtype in df.dtypes.items()]
+
+
+def parse_filter(filter_query):
+    """Split a DataTable filter query into (column, operator, value) terms joined by ' && '."""
+    terms = []
+    for part in (filter_query or '').split(' && '):
+        for symbol, operator in FILTER_OPERATORS:
+            if symbol in part:
+                name, value = part.split(symbol, 1)
+                name = name[name.find('{') + 1:name.rfind('}')]
+                value = value.strip()
+                if value[:1] == value[-1:] and value[:1] in ('"', "'", '`'):
+                    value = value[1:-1].replace('\\' + value[0], value[0])
+                else:
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        pass
+                terms.append((name, operator, value))
+                break
+    return terms
+
+
+def apply_filter(df, filter_query):
+    """Return the rows of df matching every term of a DataTable filter query; unknown columns are ignored."""
+    for column, operator, value in parse_filter(filter_query):
+        if column not in df.columns:
+            continue
+        series = df[column]
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            if isinstance(value, str) and pd.api.types.is_numeric_dtype(series):
+                continue
+            df = df[getattr(series, operator)(value)]
+        elif operator == 'contains':
+            df = df[series.astype(str).str.contains(str(value), case=False, regex=False)]
+        else:
+            df = df[series.astype(str).str.startswith(str(value))]
+    return df
+
+
+def page(df, page_current, page_size, sort_by=None, filter_query=None):
+    """Filter, sort and cut one page out of df for a DataTable with custom paging.
+
+    Returns the page as records and the page count of the filtered rows. Only
+    the rows of the page are converted to records, so the cost of a response
+    does not grow with the size of the view.
+    """
+    df = apply_filter(df, filter_query)
+    if sort_by:
+        df = df.sort_values([s['column_id'] for s in sort_by], ascending=[s['direction'] == 'asc' for s in sort_by],
+                            kind='stable', na_position='last')
+    page_size = page_size or PAGE_SIZE
+    page_count = max(math.ceil(len(df) / page_size), 1)
+    page_current = min(page_current or 0, page_count - 1)
+    start = page_current * page_size
+    return df.iloc[start:start + page_size].to_dict('records'), page_count
@@ -0,0 +1,77 @@
+import collections
+import functools
+import threading
+import numpy as np
+
+
+@functools.lru_cache(maxsize=256)
+def design_matrix(years, order):
+    """Return the column-scaled Vandermonde matrix of a year vector (a tuple) and its column scales.
+
+    The scaling is the one np.polyfit applies, which keeps the system well
+    conditioned for calendar years raised to the third power.
+    """
+    lhs = np.vander(np.asarray(years, dtype=float), order + 1)
+    scale = np.sqrt((lhs * lhs).sum(axis=0))
+    return lhs / scale, scale
+
+
+class TrendEngine:
+    """Polynomial trend lines of the time-series chart, fitted in batches and memoized.
+
+    All series of a chart that share the same observed years are fitted with a
+    single least-squares solve against a cached design matrix; a series with
+    gaps is fitted on its observed years only. The coefficients are kept per
+    (series key, attribute, order) in a bounded LRU, so toggling one series
+    never refits the others.
+    """
+
+    def __init__(self, cache_size=4096):
+        self.cache_size = cache_size
+        self._coefficients = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._coefficients:
+                self._coefficients.move_to_end(key)
+                return self._coefficients[key]
+        return None
+
+    def _put(self, key, coefficients):
+        with self._lock:
+            self._coefficients[key] = coefficients
+            if len(self._coefficients) > self.cache_size:
+                self._coefficients.popitem(last=False)
+
+    def fit(self, series_key, years, series, order):
+        """Return {attribute: coefficients (highest power first, as np.polyfit)} for the series of a chart.
+
+        series_key identifies the chart data (data version, commodity, country),
+        years is the Market_Year vector and series maps attributes to value
+        vectors aligned with it. Attributes with no more than `order` observed
+        years get no coefficients.
+        """
+        years = np.asarray(years, dtype=float)
+        fitted = {}
+        to_fit = collections.defaultdict(list)  # observed-years mask → attributes
+        for attribute, values in series.items():
+            coefficients = self._get((series_key, attribute, order))
+            if coefficients is not None:
+                fitted[attribute] = coefficients
+                continue
+            observed = np.isfinite(np.asarray(values, dtype=float))
+            if observed.sum() > order:
+                to_fit[observed.tobytes()].append(attribute)
+
+        for mask_bytes, attributes in to_fit.items():
+            observed = np.frombuffer(mask_bytes, dtype=bool)
+            lhs, scale = design_matrix(tuple(years[observed]), order)
+            rhs = np.column_stack([np.asarray(series[attribute], dtype=float)[observed] for attribute in attributes])
+            solution = np.linalg.lstsq(lhs, rhs, rcond=len(lhs) * np.finfo(float).eps)[0]
+            solution = solution / scale[:, np.newaxis]
+            for i, attribute in enumerate(attributes):
+                fitted[attribute] = solution[:, i]
+                self._put((series_key, attribute, order), solution[:, i])
+
+        return fitted
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+# Relative size below which a window sum of first differences is taken as zero: prefix-sum differences
+# leave a residue of rounding errors (about 1e-17) where the exact sum is zero
+ZERO_TOLERANCE = 1e-9
+
+
+def _prefix_sums(values):
+    """Cumulative counts and sums of the values along the year axis.
+
+    Returns the prefix sums of the count, sum, sum of squares and sum of
+    absolute values of the finite values, and of the counts of +inf and -inf
+    (NaN is missing, as in pandas). A leading column of zeros makes the total
+    over years [i, j) equal to prefix[:, j] - prefix[:, i].
+    """
+    finite = np.isfinite(values)
+    filled = np.where(finite, values, 0.0)
+    columns = (finite, filled, filled ** 2, np.abs(filled), values == np.inf, values == -np.inf)
+    zeros = np.zeros((values.shape[0], 1))
+    return tuple(np.hstack([zeros, np.cumsum(np.asarray(a, dtype=float), axis=1)]) for a in columns)
+
+
+def _mean(count, total, positive, negative):
+    """Mean of a window of values from its counts and sum, with the infinities counted as pandas does."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+    mean = np.where(positive > 0, np.inf, mean)
+    mean = np.where(negative > 0, -np.inf, mean)
+    return np.where((positive > 0) & (negative > 0), np.nan, mean)
+
+
+class YieldStats:
+    """Yield variability and growth of every series for arbitrary windows, as in the KPI panel.
+
+    The yields are laid out once as a series × market year matrix, and the
+    cumulative sums of the yields and of their first differences are kept.
+    The statistics of any window then cost a few column lookups for all
+    series at once, whatever the window length.
+
+    The statistics are those of the rows of a window: first differences are
+    taken between consecutive rows present (a missing market year is
+    skipped over), NaN yields are missing and infinite yields (zero area
+    harvested) propagate, so they equal the pandas computation of the
+    dashboard on the same rows.
+    """
+
+    def __init__(self, data, attribute='Yield', keys=('Commodity_Description', 'Country_Name')):
+        yields = data[data['Attribute_Description'] == attribute]
+        keys = list(keys)
+        series = yields.groupby(keys, observed=True, sort=True)
+        self.index = pd.MultiIndex.from_tuples(list(series.groups), names=keys) if len(yields) else \
+            pd.MultiIndex.from_arrays([[]] * len(keys), names=keys)
+        self._rows = {key: i for i, key in enumerate(self.index)}
+
+        years = yields['Market_Year'].to_numpy(dtype='int64')
+        self.first_year = int(years.min()) if len(years) else 0
+        self.last_year = int(years.max()) if len(years) else -1
+        n_years = self.last_year - self.first_year + 1
+
+        # Yield of every series and year (mean of duplicates) and the years with a row
+        rows = series.ngroup().to_numpy()
+        columns = years - self.first_year
+        values = pd.Series(yields['Value'].to_numpy(dtype='float64')).groupby([rows, columns]).mean()
+        table = np.full((len(self.index), n_years), np.nan)
+        present = np.zeros((len(self.index), n_years), dtype=bool)
+        table[values.index.get_level_values(0), values.index.get_level_values(1)] = values.to_numpy()
+        present[rows, columns] = True
+
+        # Difference of every row with the previous row of its series
+        positions = np.where(present, np.arange(n_years), -1)
+        previous = np.maximum.accumulate(np.hstack([np.full((len(self.index), 1), -1), positions[:, :-1]]), axis=1)
+        with np.errstate(invalid='ignore'):
+            diffs = np.where(present & (previous >= 0),
+                             table - np.take_along_axis(table, np.maximum(previous, 0), axis=1), np.nan)
+
+        # First row of every series at or after each year (n_years if none)
+        following = np.where(present, np.arange(n_years), n_years)
+        self._next_present = np.minimum.accumulate(following[:, ::-1], axis=1)[:, ::-1]
+
+        self._levels = _prefix_sums(table)
+        self._diffs = _prefix_sums(diffs)
+
+    def _columns(self, start_year, end_year):
+        """Return the [start, stop) columns of the years [start_year, end_year], clipped to the table."""
+        n_years = self.last_year - self.first_year + 1
+        start = min(max(start_year - self.first_year, 0), n_years)
+        stop = min(max(end_year - self.first_year + 1, start), n_years)
+        return start, stop
+
+    def cv(self, start_year, end_year):
+        """Coefficient of variation of the first differences of the rows within [start_year, end_year]."""
+        start, stop = self._columns(start_year, end_year)
+        if start >= stop:
+            return np.full(len(self.index), np.nan)
+        # The differences within the window are those of the rows after its first row
+        first = np.minimum(self._next_present[:, start] + 1, stop)
+        count, total, squares, absolute, positive, negative = (
+            p[:, stop] - np.take_along_axis(p, first[:, None], axis=1)[:, 0] for p in self._diffs)
+        mean = _mean(count, total, positive, negative)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.sqrt(np.maximum(squares - total * total / count, 0) / (count - 1))
+            cv = std / mean / 100
+        is_zero = np.abs(total) <= ZERO_TOLERANCE * absolute
+        return np.where((count >= 2) & (positive + negative == 0) & ~is_zero, cv, np.nan)
+
+    def cagr(self, start_year, end_year, length):
+        """Compound annual growth from the mean yield of the first `length` years to that of the last `length` years."""
+        periods = end_year - start_year - length + 1
+        if periods <= 0:
+            return np.full(len(self.index), np.nan)
+        means = []
+        for first_year, last_year in [(start_year, start_year + length - 1), (end_year - length + 1, end_year)]:
+            start, stop = self._columns(first_year, last_year)
+            count, total, _, _, positive, negative = (p[:, stop] - p[:, start] for p in self._levels)
+            means.append(_mean(count, total, positive, negative))
+        early, late = means
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            return np.where((early > 0) & (late > 0), (late / early) ** (1 / periods) - 1, 0.0)
+
+    def table(self, start_year, end_year, length):
+        """Return the CV and CAGR of every series for one window."""
+        return pd.DataFrame({'Yield_CV': self.cv(start_year, end_year),
+                             'Yield_CAGR': self.cagr(start_year, end_year, length)}, index=self.index)
+
+    def lookup(self, commodity, country, start_year, end_year, length):
+        """Return (CV, CAGR) of one series for a window, or (None, None) if it has no yields."""
+        row = self._rows.get((commodity, country))
+        if row is None:
+            return None, None
+        cv = self.cv(start_year, end_year)[row]
+        cagr = self.cagr(start_year, end_year, length)[row]
+        return (None if np.isnan(cv) else cv), (None if np.isnan(cagr) else cagr)